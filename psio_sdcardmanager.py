@@ -25,14 +25,14 @@ from json import load, dumps
 from os.path import join, dirname, abspath
 from sys import argv
 
-from PyQt6.QtGui import QStandardItemModel, QStandardItem
+from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, QProgressBar, QTreeView, QCheckBox, QFrame,
-                             QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, QScrollBar, QHeaderView, QLineEdit)
-from pathlib2 import Path
+                             QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, QScrollBar, QHeaderView, QLineEdit,
+                             QMessageBox)
 
-# Local imports
-from psio_sdcardmanager.cue2cu2 import set_cu2_error_log_path
-from psio_sdcardmanager.gamehandler import GameHandler
+# Local imports (GameHandler and the rest of the core are only imported once the first scan starts)
+from psio_sdcardmanager.game_list_model import GameListModel
+from psio_sdcardmanager.workers import ScanWorker, ProcessWorker, start_worker
 
 CURRENT_REVISION = 0.1
 PROGRESS_STATUS = 'Status:'
@@ -40,15 +40,12 @@ logger = logging.getLogger(__name__)
 covers_path = None
 
 # Get the directory paths based on the scripts location
-script_root_dir = Path(abspath(dirname(argv[0])))
+script_root_dir = abspath(dirname(argv[0]))
 covers_path = join(dirname(script_root_dir), 'covers')
 error_log_file = join(dirname(script_root_dir), 'errors.txt')
 
 CONFIG_FILE_PATH = join(script_root_dir, 'config')
 
-# Set the error log path for all of the scripts
-set_cu2_error_log_path(error_log_file)
-
 
 # *************************************************
 # Run the GUI
@@ -74,8 +71,13 @@ class MainWindow(QMainWindow):
         self.button_src_browse = QPushButton('Browse')
         self.button_src_scan = QPushButton('Scan')
         self.button_start = QPushButton('Start').setEnabled(False)
-        self.game_handler = GameHandler()
+        self.button_cancel = QPushButton('Cancel')
+        # Created by _get_game_handler on first use, so the window opens without loading the core
+        self.game_handler = None
         self.game_list = []
+        # The scan or process worker currently running, and its thread
+        self.worker = None
+        self.worker_thread = None
         self.initUI()
 
     def initUI(self):
@@ -115,10 +117,10 @@ class MainWindow(QMainWindow):
         self.button_src_browse.clicked.connect(self.browse_button_clicked)
         browse_layout.addWidget(self.button_src_browse)
 
-        # Indeterminate progress bar
-        progress_bar_indeterminate = QProgressBar()
-        progress_bar_indeterminate.setRange(0, 0)  # Indeterminate mode
-        main_layout.addWidget(progress_bar_indeterminate)
+        # Scan progress bar (indeterminate until the number of directories is known)
+        self.progress_bar_indeterminate = QProgressBar()
+        self.progress_bar_indeterminate.setRange(0, 1)
+        main_layout.addWidget(self.progress_bar_indeterminate)
 
         # Scan button
         self.button_src_scan.clicked.connect(self._scan_button_clicked)
@@ -133,16 +135,24 @@ class MainWindow(QMainWindow):
         game_list_layout = QVBoxLayout()
         game_list_frame.setLayout(game_list_layout)
 
+        self.line_edit_filter = QLineEdit()
+        self.line_edit_filter.setPlaceholderText('Filter by name or ID')
+        game_list_layout.addWidget(self.line_edit_filter)
+
         self.treeview_game_list = QTreeView()
         game_list_layout.addWidget(self.treeview_game_list)
 
-        # Example headers, replace with your logic
-        model = QStandardItemModel()
-        headers = ['ID', 'Name', 'Disc Number', 'Bin Files', 'Name Valid', 'CU2', 'BMP']
-        model.setHorizontalHeaderLabels(headers)
+        # The model reads the Game objects directly, so rows are only rendered when they scroll into view
+        self.game_list_model = GameListModel()
+        self.line_edit_filter.textChanged.connect(self.game_list_model.set_filter)
 
-        self.treeview_game_list.setModel(model)
-        self.treeview_game_list.header().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.treeview_game_list.setModel(self.game_list_model)
+        self.treeview_game_list.setRootIsDecorated(False)
+        self.treeview_game_list.setUniformRowHeights(True)
+        self.treeview_game_list.setSortingEnabled(True)
+        self.treeview_game_list.sortByColumn(1, Qt.SortOrder.AscendingOrder)
+        # ResizeToContents would measure every row on each insert
+        self.treeview_game_list.header().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
 
         scrollbar_game_list = QScrollBar()
         game_list_layout.addWidget(scrollbar_game_list)
@@ -187,16 +197,21 @@ class MainWindow(QMainWindow):
         progress_layout = QVBoxLayout()
         progress_frame.setLayout(progress_layout)
 
-        progress_bar = QProgressBar()
-        progress_layout.addWidget(progress_bar)
+        self.progress_bar = QProgressBar()
+        progress_layout.addWidget(self.progress_bar)
 
         self.button_start = QPushButton('Start')
         self.button_start.clicked.connect(self._start_button_clicked)
         self.button_start.setEnabled(False)  # Set initial state
         progress_layout.addWidget(self.button_start)
 
-        label_progress = QLabel('Progress Status')
-        progress_layout.addWidget(label_progress)
+        self.button_cancel = QPushButton('Cancel')
+        self.button_cancel.clicked.connect(self._cancel_button_clicked)
+        self.button_cancel.setEnabled(False)
+        progress_layout.addWidget(self.button_cancel)
+
+        self.label_progress = QLabel('Progress Status')
+        progress_layout.addWidget(self.label_progress)
 
         # Ensure database existence
         # QCoreApplication.instance().aboutToQuit.connect(ensure_database_exists)
@@ -225,71 +240,157 @@ class MainWindow(QMainWindow):
 
     # *****************************************************************************************************************
     # Function to update the progress bar
-    def _update_progress_bar(value):
-        # progress_bar['value'] = value
-        if window is not None:
-            window.update()
+    def _update_progress_bar(self, done, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
 
     # *****************************************************************************************************************
 
-    # Function to update the intermediate progress bar
-    def _update_progress_bar_2(value):
-        # progress_bar_indeterminate['value'] = value
-        if window is not None:
-            window.update_idletasks()
+    # Function to update the scan progress bar
+    def _update_progress_bar_2(self, done, total):
+        self.progress_bar_indeterminate.setRange(0, total)
+        self.progress_bar_indeterminate.setValue(done)
+
+    # *****************************************************************************************************************
+
+    # *****************************************************************************************************************
+    # Function to update the progress status label
+    def _update_status(self, text):
+        self.label_progress.setText(f'{PROGRESS_STATUS} {text}')
+
+    # *****************************************************************************************************************
+
+    # *****************************************************************************************************************
+    # Function that loads the core and creates the GameHandler the first time it is needed
+    def _get_game_handler(self):
+        if self.game_handler is None:
+            from psio_sdcardmanager.cue2cu2 import set_cu2_error_log_path
+            from psio_sdcardmanager.gamehandler import GameHandler
+
+            # Set the error log path for all of the scripts
+            set_cu2_error_log_path(error_log_file)
+            self.game_handler = GameHandler()
+        return self.game_handler
+
+    # *****************************************************************************************************************
 
     # *****************************************************************************************************************
+    # Function to run a worker in its own thread, so the window keeps responding while it works
+    def _start_worker(self, worker, finished):
+        self.worker = worker
+        worker.finished.connect(finished)
+        worker.failed.connect(self._worker_failed)
+        self.worker_thread = start_worker(worker, self._worker_thread_finished)
+        self.button_cancel.setEnabled(True)
+
+    def _worker_done(self):
+        self.button_cancel.setEnabled(False)
+
+    # The worker and its thread are only let go of once the thread has stopped, then the next one can be started
+    def _worker_thread_finished(self):
+        self.worker = None
+        self.worker_thread = None
+        self.button_src_scan.setEnabled(True)
+        self._update_start_button()
+
+    def _worker_failed(self, error):
+        self._worker_done()
+        self._update_status(f'Failed - {error}')
+
+    # Cancel button click event
+    def _cancel_button_clicked(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.button_cancel.setEnabled(False)
+            self._update_status('Cancelling...')
 
     # *****************************************************************************************************************
-    # Function to update the main ui window
-    def _update_window(self):
-        if window is not None:
-            window.update_idletasks()  # *****************************************************************************************************************
 
     # *****************************************************************************************************************
     # Scan button click event
     def _scan_button_clicked(self):
         self.button_src_scan.setEnabled(False)
-        self.game_list = self.game_handler.parse_game_list(src_path.text())
+        self.button_start.setEnabled(False)
+        self.game_list = []
         self._display_game_list(self.game_list)
-        if self.checkbox_generate_cu2.isChecked() or self.checkbox_merge_bin.isChecked() or self.checkbox_add_art.isChecked() or self.checkbox_limit_name.isChecked() or self.checkbox_auto_rename.isChecked():
-            self.button_start.setEnabled(True)
+        self.progress_bar_indeterminate.setRange(0, 0)  # Indeterminate mode
+        self._update_status('Scanning')
+
+        worker = ScanWorker(self._get_game_handler(), src_path.text())
+        worker.progress.connect(self._update_progress_bar_2)
+        worker.games_found.connect(self._append_games)
+        self._start_worker(worker, self._scan_finished)
+
+    def _scan_finished(self, result):
+        cancelled = self.worker.is_cancelled()
+        self._worker_done()
+        self.game_list, details = result
+
+        # Redisplay the sorted list with the disc numbers resolved at the end of the scan
+        self._display_game_list(self.game_list)
+        self.progress_bar_indeterminate.setRange(0, 1)
+        self.progress_bar_indeterminate.setValue(1)
+
+        if cancelled:
+            self._update_status('Scan cancelled')
+            return
+        self._update_status('Scan complete')
+
+        msg_box = QMessageBox()
+        msg_box.setWindowTitle('Game Details')
+        msg_box.setText(details)
+        msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+        msg_box.setFixedWidth(650)
+        msg_box.exec()
 
     def _display_game_list(self, game_list):
-        bools = ('No', 'Yes')
-        self.treeview_game_list.model().removeRows(0,
-                                                   self.treeview_game_list.model().rowCount())  # Clear existing rows if any
-
-        for game in game_list:
-            game_id = QStandardItem(str(game.id))
-            game_name = QStandardItem(game.cue_sheet.game_name)
-            disc_number = QStandardItem(str(game.disc_number))
-            number_of_bins = QStandardItem(str(len(game.cue_sheet.bin_files)))
-            name_valid = QStandardItem(str(""))
-            cu2_present = QStandardItem(bools[game.cu2_present])
-            bmp_present = QStandardItem(bools[game.cover_art_present])
-
-            row = [game_id, game_name, disc_number, number_of_bins, name_valid, cu2_present, bmp_present]
-            self.treeview_game_list.model().appendRow(row)
+        self.game_list_model.set_games(game_list)
+
+    def _append_games(self, game_list):
+        self.game_list_model.append_games(game_list)
 
     # Start button click event
     def _start_button_clicked(self):
         if not src_path.text() == '':
             self.button_start.setEnabled(False)
-            self.game_handler.process_games(self.checkbox_merge_bin.isChecked(), self.checkbox_generate_cu2.isChecked(),
-                                            self.checkbox_auto_rename.isChecked(), self.checkbox_limit_name.isChecked(),
-                                            self.checkbox_add_art.isChecked(), self.game_list)
-            self.button_start.setEnabled(True)
+            self.button_src_scan.setEnabled(False)
+            self.progress_bar.setValue(0)
+
+            worker = ProcessWorker(self._get_game_handler(), self.game_list,
+                                   merge_bin_files=self.checkbox_merge_bin.isChecked(),
+                                   force_cu2=self.checkbox_generate_cu2.isChecked(),
+                                   auto_rename=self.checkbox_auto_rename.isChecked(),
+                                   validate_game_name=self.checkbox_limit_name.isChecked(),
+                                   add_cover_art=self.checkbox_add_art.isChecked(),
+                                   create_multi_disc=self.checkbox_create_multi_disc.isChecked())
+            worker.progress.connect(self._update_progress_bar)
+            worker.status.connect(self._update_status)
+            worker.game_processed.connect(self.game_list_model.game_updated)
+            self._start_worker(worker, self._process_finished)
+
+    def _process_finished(self, game_list):
+        cancelled = self.worker.is_cancelled()
+        self._worker_done()
+        self._display_game_list(game_list)
+        self._update_status('Processing cancelled' if cancelled else 'Processing complete')
+
+    # Window close event, a running worker is cancelled and waited for so no file is left half written
+    def closeEvent(self, event):
+        if self.worker_thread is not None:
+            self.worker.cancel()
+            self.worker_thread.wait()
+        super().closeEvent(event)
 
     # Checkbox change event
     def checkbox_changed(self):
-        if not self.checkbox_generate_cu2.isChecked() and not self.checkbox_merge_bin.isChecked() and not self.checkbox_add_art.isChecked() and not self.checkbox_limit_name.isChecked() and not self.checkbox_auto_rename.isChecked():
-            self.button_start.setEnabled(False)
-
-        if src_path.text() is not None and src_path.text() != '':
-            if self.checkbox_generate_cu2.isChecked() or self.checkbox_merge_bin.isChecked() or self.checkbox_add_art.isChecked() or self.checkbox_limit_name.isChecked() or self.checkbox_auto_rename.isChecked():
-                # if game_list:
-                self.button_start.setEnabled(True)
+        self._update_start_button()
+
+    # Function to enable the start button when there is a path, no worker running and at least one task selected
+    def _update_start_button(self):
+        tasks_selected = (self.checkbox_generate_cu2.isChecked() or self.checkbox_merge_bin.isChecked() or
+                          self.checkbox_add_art.isChecked() or self.checkbox_limit_name.isChecked() or
+                          self.checkbox_auto_rename.isChecked() or self.checkbox_create_multi_disc.isChecked())
+        self.button_start.setEnabled(bool(src_path.text()) and tasks_selected and self.worker is None)
 
     # *****************************************************************************************************************
 
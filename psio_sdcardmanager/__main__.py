@@ -0,0 +1,167 @@
+"""
+Headless command line interface, e.g. python -m psio_sdcardmanager scan /media/sdcard
+
+Results are printed to stdout as JSON and logging goes to stderr, so the commands can be scripted (e.g. from cron).
+Nothing here imports Qt.
+"""
+import argparse
+import logging
+import sys
+from json import dumps
+from os.path import join
+
+from psio_sdcardmanager.covers import COVER_PROFILES, DEFAULT_COVER_PROFILE
+
+logger = logging.getLogger(__name__)
+
+
+# Function that converts a game to the JSON object printed by the commands
+def _game_to_json(game):
+    return {
+        'id': game.id,
+        'name': game.cue_sheet.game_name,
+        'disc_number': game.disc_number,
+        'disc_collection': game.disc_collection,
+        'path': join(game.directory_path, game.directory_name),
+        'cue_sheet': game.cue_sheet.file_path,
+        'bin_files': [bin_file.file_path for bin_file in game.cue_sheet.bin_files],
+        'cu2_present': game.cu2_present,
+        'cover_art_present': game.cover_art_present,
+        'unidentified': game.unidentified,
+        'no_cover': game.no_cover,
+        'multi_disc': game.multi_disc,
+        'multi_bin': game.multi_bin,
+        'invalid_name': game.invalid_name,
+    }
+
+
+def _summary(game_list):
+    return {
+        'total_discs': len(game_list),
+        'multi_disc_games': sum(game.multi_disc for game in game_list),
+        'unidentified_games': sum(game.unidentified for game in game_list),
+        'multi_bin_games': sum(game.multi_bin for game in game_list),
+        'missing_covers': sum(game.no_cover for game in game_list),
+        'invalid_game_names': sum(game.invalid_name for game in game_list),
+    }
+
+
+# The one-off database merge takes a while, so its progress goes to stderr even without -v
+def _database_merge_progress(done, total):
+    print(f'Merging database: {done}/{total}', file=sys.stderr)
+
+
+def _print_json(data):
+    print(dumps(data, indent=2))
+
+
+# Function that scans the library and runs process_games with the given tasks switched on
+def _process_library(game_handler, args, merge_bin_files=False, force_cu2=False, auto_rename=False,
+                     validate_game_name=False, add_cover_art=False, merge_in_place=False, create_multi_disc=False,
+                     cover_profile=DEFAULT_COVER_PROFILE):
+    game_list = game_handler.parse_game_list(args.path)
+
+    def game_processed(done, total, game):
+        logging.log(logging.INFO, f'[{done}/{total}] {game.cue_sheet.game_name}')
+
+    game_handler.process_games(merge_bin_files, force_cu2, auto_rename, validate_game_name, add_cover_art, game_list,
+                               merge_in_place=merge_in_place, progress_callback=game_processed,
+                               create_multi_disc=create_multi_disc, cover_profile=cover_profile)
+    return {'processed': len(game_list), 'games': [_game_to_json(game) for game in game_list]}
+
+
+def command_scan(game_handler, args):
+    game_list = game_handler.parse_game_list(args.path)
+    _print_json({'summary': _summary(game_list), 'games': [_game_to_json(game) for game in game_list]})
+    return 0
+
+
+def command_process(game_handler, args):
+    _print_json(_process_library(game_handler, args, merge_bin_files=args.merge, force_cu2=args.cu2,
+                                 auto_rename=args.rename, validate_game_name=args.fix_names,
+                                 add_cover_art=args.covers, merge_in_place=args.in_place,
+                                 create_multi_disc=args.multi_disc, cover_profile=args.cover_profile))
+    return 0
+
+
+def command_merge(game_handler, args):
+    _print_json(_process_library(game_handler, args, merge_bin_files=True, merge_in_place=args.in_place))
+    return 0
+
+
+def command_cu2(game_handler, args):
+    game_list = game_handler.parse_game_list(args.path)
+    results = game_handler.generate_cu2_sheets(game_list, dry_run=args.dry_run)
+    _print_json({
+        'dry_run': args.dry_run,
+        'results': [{'name': result.game.cue_sheet.game_name, 'cue_sheet': result.game.cue_sheet.file_path,
+                     'success': result.success, 'cu2_path': result.cu2_path, 'error': result.error,
+                     'warnings': result.warnings} for result in results],
+    })
+    return 0 if all(result.success for result in results) else 1
+
+
+def command_covers(game_handler, args):
+    _print_json(_process_library(game_handler, args, add_cover_art=True, cover_profile=args.cover_profile))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m psio_sdcardmanager',
+                                     description='Prepare PlayStation game backups on an SD card for PSIO.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress to stderr')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help='scan a library and print the games found')
+    scan_parser.set_defaults(command_function=command_scan)
+
+    process_parser = subparsers.add_parser('process', help='run the selected tasks over a library')
+    process_parser.add_argument('--merge', action='store_true', help='merge multi-bin games')
+    process_parser.add_argument('--in-place', action='store_true', help='merge into the first track file')
+    process_parser.add_argument('--cu2', action='store_true', help='generate missing CU2 sheets')
+    process_parser.add_argument('--rename', action='store_true', help='rename games to their redump names')
+    process_parser.add_argument('--fix-names', action='store_true', help='shorten names PSIO cannot display')
+    process_parser.add_argument('--covers', action='store_true', help='add the cover art')
+    process_parser.add_argument('--multi-disc', action='store_true', help='create MULTIDISC.LST files')
+    process_parser.set_defaults(command_function=command_process)
+
+    merge_parser = subparsers.add_parser('merge', help='merge multi-bin games')
+    merge_parser.add_argument('--in-place', action='store_true', help='merge into the first track file')
+    merge_parser.set_defaults(command_function=command_merge)
+
+    cu2_parser = subparsers.add_parser('cu2', help='generate missing CU2 sheets')
+    cu2_parser.add_argument('--dry-run', action='store_true', help='only report what would fail')
+    cu2_parser.set_defaults(command_function=command_cu2)
+
+    covers_parser = subparsers.add_parser('covers', help='add the cover art')
+    covers_parser.set_defaults(command_function=command_covers)
+
+    for subparser in (process_parser, covers_parser):
+        subparser.add_argument('--cover-profile', choices=COVER_PROFILES, default=DEFAULT_COVER_PROFILE,
+                               help='device the cover art is written for')
+
+    for subparser in (scan_parser, process_parser, merge_parser, cu2_parser, covers_parser):
+        subparser.add_argument('path', help='SD card or library directory')
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr)
+
+    # Every command looks the games up, so the split database files are merged first if needed
+    from psio_sdcardmanager.db import ensure_database_exists, DatabaseUnavailableError
+    try:
+        ensure_database_exists(_database_merge_progress)
+    except DatabaseUnavailableError as error:
+        print(f'psio_sdcardmanager: {error}', file=sys.stderr)
+        return 1
+
+    from psio_sdcardmanager.gamehandler import GameHandler
+
+    return args.command_function(GameHandler(), args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
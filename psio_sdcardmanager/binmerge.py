@@ -25,6 +25,10 @@
 #  Please report any bugs on GitHub: https://github.com/putnam/binmerge
 #
 #
+import bisect
+import errno
+import io
+import json
 import logging
 import os
 import re
@@ -32,12 +36,23 @@ import textwrap
 from os.path import exists, join
 
 from psio_sdcardmanager.cue2cu2 import _log_error
+from psio_sdcardmanager.cue_parser import parse_cue, DEFAULT_BLOCKSIZE
+# The exceptions moved to cue_parser, they are still importable from here for code written against binmerge
+# pylint: disable=unused-import
+from psio_sdcardmanager.cue_parser import ZeroBinFilesException, BinFilesMissingException
+# pylint: enable=unused-import
 
 logger = logging.getLogger(__name__)
 
 VERBOSE = False
 VERSION_STRING = "1.0.3"
 
+IN_PLACE_JOURNAL_SUFFIX = '.merge-journal'
+
+# errno values meaning the kernel cannot copy between this pair of files, so the next method should be tried
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+                           errno.ETXTBSY, errno.EPERM}
+
 
 def print_license():
     print(textwrap.dedent(f"""
@@ -75,99 +90,88 @@ def p(s):
     print("[INFO]\t%s" % s)
 
 
-class Track:
-    globalBlocksize = None
-
-    def __init__(self, num, track_type):
-        self.num = num
-        self.indexes = []
-        self.track_type = track_type
-        self.sectors = None
-        self.file_offset = None
-
-        # All possible blocksize types. You cannot mix types on a disc, so we will use the first one we see and lock
-        # it in.
-        #
-        # AUDIO – Audio/Music (2352)
-        # CDG – Karaoke CD+G (2448)
-        # MODE1/2048 – CDROM Mode1 Data (cooked)
-        # MODE1/2352 – CDROM Mode1 Data (raw)
-        # MODE2/2336 – CDROM-XA Mode2 Data
-        # MODE2/2352 – CDROM-XA Mode2 Data
-        # CDI/2336 – CDI Mode2 Data
-        # CDI/2352 – CDI Mode2 Data
-        if not Track.globalBlocksize:
-            if track_type in ['AUDIO', 'MODE1/2352', 'MODE2/2352', 'CDI/2352']:
-                Track.globalBlocksize = 2352
-            elif track_type == 'CDG':
-                Track.globalBlocksize = 2448
-            elif track_type == 'MODE1/2048':
-                Track.globalBlocksize = 2048
-            elif track_type in ['MODE2/2336', 'CDI/2336']:
-                Track.globalBlocksize = 2336
-            d("Locked blocksize to %d" % Track.globalBlocksize)
-
-
-class File:
-    def __init__(self, filename):
-        self.filename = filename
-        self.tracks = []
-        self.size = os.path.getsize(filename)
-
-
-class ZeroBinFilesException(Exception):
-    pass
-
-
-class BinFilesMissingException(Exception):
-    pass
+# Presents the track files of a cue sheet as one seekable, read-only image, without merging them on disk.
+# Reads that cross the end of one track file carry on into the next, so callers can address sectors across the
+# whole disc just as they would in a merged bin.
+class VirtualDisc(io.RawIOBase):
+    def __init__(self, cue):
+        super().__init__()
+        self.cue = cue
+        self.files = cue.files
+        self.offsets = []
+        self.size = 0
+        for f in self.files:
+            self.offsets.append(self.size)
+            self.size += f.size
+        self.blocksize = cue.blocksize
+        self.position = 0
+        self.handles = {}
+
+    @classmethod
+    def from_cue(cls, cue_path):
+        return cls(parse_cue(cue_path))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        filled = 0
+        while filled < len(view) and self.position < self.size:
+            file_index = bisect.bisect_right(self.offsets, self.position) - 1
+            file_end = self.offsets[file_index] + self.files[file_index].size
+
+            handle = self._handle(file_index)
+            handle.seek(self.position - self.offsets[file_index])
+            count = handle.readinto(view[filled:filled + min(len(view) - filled, file_end - self.position)])
+            if not count:
+                break
+            filled += count
+            self.position += count
+        return filled
+
+    def read_sector(self, lba):
+        self.seek(lba * self.blocksize)
+        return self.read(self.blocksize)
+
+    # Generates the cue sheet the disc would have once merged, so track positions are relative to the whole image
+    def merged_cuesheet(self, basename):
+        return gen_merged_cuesheet(basename, self.files, self.blocksize)
+
+    def _handle(self, file_index):
+        handle = self.handles.get(file_index)
+        if handle is None:
+            handle = open(self.files[file_index].filename, 'rb', buffering=0)
+            self.handles[file_index] = handle
+        return handle
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+        super().close()
 
 
 def read_cue_file(cue_path):
-    files = []
-    this_track = None
-    this_file = None
-    bin_files_missing = False
-
-    f = open(cue_path, 'r')
-    for line in f:
-        m = re.search(r'FILE "?(.*?)"? BINARY', line)
-        if m:
-            this_path = os.path.join(os.path.dirname(cue_path), m.group(1))
-            if not (os.path.isfile(this_path) or os.access(this_path, os.R_OK)):
-                e("Bin file not found or not readable: %s" % this_path)
-                bin_files_missing = True
-            else:
-                this_file = File(this_path)
-                files.append(this_file)
-            continue
-
-        m = re.search(r'TRACK (\d+) ([^\s]*)', line)
-        if m and this_file:
-            this_track = Track(int(m.group(1)), m.group(2))
-            this_file.tracks.append(this_track)
-            continue
-
-        m = re.search(r'INDEX (\d+) (\d+:\d+:\d+)', line)
-        if m and this_track:
-            this_track.indexes.append(
-                {'id': int(m.group(1)), 'stamp': m.group(2), 'file_offset': cuestamp_to_sectors(m.group(2))})
-            continue
-
-    if bin_files_missing:
-        raise BinFilesMissingException
-
-    if not len(files):
-        raise ZeroBinFilesException
-
-    if len(files) == 1:
-        # only 1 file, assume splitting, calc sectors of each
-        next_item_offset = files[0].size // Track.globalBlocksize
-        for t in reversed(files[0].tracks):
-            t.sectors = next_item_offset - t.indexes[0]["file_offset"]
-            next_item_offset = t.indexes[0]["file_offset"]
+    cue = parse_cue(cue_path)
 
-    for f in files:
+    for f in cue.files:
         d("-- File --")
         d("Filename: %s" % f.filename)
         d("Size: %d" % f.size)
@@ -180,7 +184,7 @@ def read_cue_file(cue_path):
             if t.sectors: d("  Sectors: %s" % t.sectors)
             d("  Indexes: %s" % repr(t.indexes))
 
-    return files
+    return cue.files
 
 
 def sectors_to_cuestamp(sectors):
@@ -221,7 +225,7 @@ def track_filename(prefix, track_num, track_count):
 
 
 # Generates a 'merged' cuesheet, that is, one bin file with tracks indexed within.
-def gen_merged_cuesheet(basename, files):
+def gen_merged_cuesheet(basename, files, blocksize=DEFAULT_BLOCKSIZE):
     cuesheet = 'FILE "%s.bin" BINARY\n' % basename
     # One sector is (BLOCKSIZE) bytes
     sector_pos = 0
@@ -229,8 +233,8 @@ def gen_merged_cuesheet(basename, files):
         for t in f.tracks:
             cuesheet += '  TRACK %02d %s\n' % (t.num, t.track_type)
             for i in t.indexes:
-                cuesheet += '    INDEX %02d %s\n' % (i['id'], sectors_to_cuestamp(sector_pos + i['file_offset']))
-        sector_pos += f.size / Track.globalBlocksize
+                cuesheet += '    INDEX %02d %s\n' % (i.id, sectors_to_cuestamp(sector_pos + i.file_offset))
+        sector_pos += f.size // blocksize
     return cuesheet
 
 
@@ -242,33 +246,72 @@ def gen_split_cuesheet(basename, merged_file):
         cuesheet += 'FILE "%s" BINARY\n' % track_fn
         cuesheet += '  TRACK %02d %s\n' % (t.num, t.track_type)
         for i in t.indexes:
-            sector_pos = i['file_offset'] - t.indexes[0]['file_offset']
-            cuesheet += '    INDEX %02d %s\n' % (i['id'], sectors_to_cuestamp(sector_pos))
+            sector_pos = i.file_offset - t.indexes[0].file_offset
+            cuesheet += '    INDEX %02d %s\n' % (i.id, sectors_to_cuestamp(sector_pos))
     return cuesheet
 
 
+# Copies `length` bytes from the current position of `infile` to the current position of `outfile`.
+# Both must be unbuffered (raw) file objects so their positions are the OS file offsets.
+#
+# Tries copy_file_range first (kernel-side, and a reflink on filesystems that support it), then sendfile, and falls
+# back to a plain buffered loop when neither is available for this pair of files.
+def copy_file_data(infile, outfile, length, chunksize=1024 * 1024):
+    copied = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                count = os.copy_file_range(infile.fileno(), outfile.fileno(), length - copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError as error:
+            if error.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+            d('copy_file_range unavailable (%s), falling back' % error)
+
+    if copied < length and hasattr(os, 'sendfile'):
+        try:
+            while copied < length:
+                offset = infile.tell()
+                count = os.sendfile(outfile.fileno(), infile.fileno(), offset, length - copied)
+                if count == 0:
+                    break
+                # sendfile with an explicit offset leaves the input position alone
+                infile.seek(offset + count)
+                copied += count
+        except OSError as error:
+            if error.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+            d('sendfile unavailable (%s), falling back' % error)
+
+    while copied < length:
+        chunk = infile.read(min(chunksize, length - copied))
+        if not chunk:
+            break
+        outfile.write(chunk)
+        copied += len(chunk)
+
+    return copied
+
+
 # Merges files together to new file `merged_filename`, in listed order.
 def merge_files(merged_filename, files):
     if os.path.exists(merged_filename):
         e('Target merged bin path already exists: %s' % merged_filename)
         return False
 
-    # cat is actually a bit faster, but this is multi-platform and no special-casing
-    chunksize = 1024 * 1024
-    with open(merged_filename, 'wb') as outfile:
+    with open(merged_filename, 'wb', buffering=0) as outfile:
         for f in files:
-            with open(f.filename, 'rb') as infile:
-                while True:
-                    chunk = infile.read(chunksize)
-                    if not chunk:
-                        break
-                    outfile.write(chunk)
+            with open(f.filename, 'rb', buffering=0) as infile:
+                copy_file_data(infile, outfile, f.size)
     return True
 
 
 # Writes each track in a File to a new file
-def split_files(new_basename, merged_file, outdir):
-    with open(merged_file.filename, 'rb') as infile:
+def split_files(new_basename, merged_file, outdir, blocksize=DEFAULT_BLOCKSIZE):
+    with open(merged_file.filename, 'rb', buffering=0) as infile:
         # Check all tracks for potential file-clobbering first before writing anything
         for t in merged_file.tracks:
             out_basename = track_filename(new_basename, t.num, len(merged_file.tracks))
@@ -278,31 +321,135 @@ def split_files(new_basename, merged_file, outdir):
                 return False
 
         for t in merged_file.tracks:
-            chunksize = 1024 * 1024
             out_basename = track_filename(new_basename, t.num, len(merged_file.tracks))
             out_path = os.path.join(outdir, out_basename)
-            tracksize = t.sectors * Track.globalBlocksize
-            written = 0
-            with open(out_path, 'wb') as outfile:
+            tracksize = t.sectors * blocksize
+            with open(out_path, 'wb', buffering=0) as outfile:
                 d('Writing bin file: %s' % out_path)
-                while True:
-                    if chunksize + written > tracksize:
-                        chunksize = tracksize - written
-                    chunk = infile.read(chunksize)
-                    outfile.write(chunk)
-                    written += chunksize
-                    if written == tracksize:
-                        break
+                copy_file_data(infile, outfile, tracksize)
+    return True
+
+
+# Merges files in place: the remaining tracks are appended to the first track file, and each one is deleted as soon
+# as it has been consumed. Peak extra space is one track and only the non-first tracks are written.
+#
+# Every step is driven by a journal written before anything is touched, so an interrupted merge can be rolled
+# forward with resume_in_place_merge. Each step is idempotent, re-running it after a crash is always safe.
+def merge_files_in_place(cue, game_name):
+    cuefile = cue.path
+    files = cue.files
+    outdir = os.path.dirname(cuefile)
+    merged_bin = join(outdir, game_name + '.bin')
+    merged_cue = join(outdir, game_name + '.cue')
+    if exists(merged_bin) and merged_bin != files[0].filename:
+        e('Target merged bin path already exists: %s' % merged_bin)
+        return False
+
+    journal = {
+        'target': files[0].filename,
+        'base_size': files[0].size,
+        'parts': [[f.filename, f.size] for f in files[1:]],
+        'merged_bin': merged_bin,
+        'merged_cue': merged_cue,
+        'original_cue': cuefile,
+        'cuesheet': gen_merged_cuesheet(game_name, files, cue.blocksize),
+    }
+    journal_path = in_place_journal_path(outdir, game_name)
+    _write_journal(journal_path, journal)
+
+    return _roll_forward(journal_path, journal)
+
+
+def in_place_journal_path(outdir, game_name):
+    return join(outdir, game_name + IN_PLACE_JOURNAL_SUFFIX)
+
+
+# Finishes every interrupted in-place merge found in a directory
+def resume_in_place_merges(directory):
+    resumed = False
+    for file_name in os.listdir(directory):
+        if file_name.endswith(IN_PLACE_JOURNAL_SUFFIX):
+            resumed = resume_in_place_merge(join(directory, file_name)) or resumed
+    return resumed
+
+
+def resume_in_place_merge(journal_path):
+    try:
+        with open(journal_path, 'r') as journal_file:
+            journal = json.load(journal_file)
+    except (OSError, ValueError) as error:
+        _log_error('ERROR', f'Could not read merge journal {journal_path}: {error}')
+        return False
+
+    p('Rolling forward interrupted merge: %s' % journal['merged_bin'])
+    return _roll_forward(journal_path, journal)
+
+
+def _roll_forward(journal_path, journal):
+    target = journal['target']
+
+    # Step 1: append the remaining tracks. A part that still exists may have been partially appended, so the target
+    # is cut back to where that part starts before appending it again. A part is only deleted once the data is synced.
+    if exists(target):
+        offset = journal['base_size']
+        for part_filename, part_size in journal['parts']:
+            if exists(part_filename):
+                with open(target, 'r+b', buffering=0) as outfile, open(part_filename, 'rb', buffering=0) as infile:
+                    outfile.truncate(offset)
+                    outfile.seek(offset)
+                    if copy_file_data(infile, outfile, part_size) != part_size:
+                        _log_error('ERROR', f'Short read while appending {part_filename}')
+                        return False
+                    os.fsync(outfile.fileno())
+                os.remove(part_filename)
+            elif os.path.getsize(target) < offset + part_size:
+                _log_error('ERROR', f'Merge journal {journal_path} refers to a missing track: {part_filename}')
+                return False
+            offset += part_size
+
+        # Step 2: give the merged bin its final name
+        os.replace(target, journal['merged_bin'])
+    elif not exists(journal['merged_bin']):
+        _log_error('ERROR', f'Neither the first track nor the merged bin exist for journal {journal_path}')
+        return False
+
+    # Step 3: swap in the merged cue sheet
+    temp_cue = journal['merged_cue'] + '.tmp'
+    with open(temp_cue, 'w', newline='\r\n') as f:
+        f.write(journal['cuesheet'])
+    os.replace(temp_cue, journal['merged_cue'])
+    if journal['original_cue'] != journal['merged_cue'] and exists(journal['original_cue']):
+        os.remove(journal['original_cue'])
+
+    # Step 4: the merge is complete
+    os.remove(journal_path)
     return True
 
 
+def _write_journal(journal_path, journal):
+    temp_path = journal_path + '.tmp'
+    with open(temp_path, 'w') as journal_file:
+        json.dump(journal, journal_file)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    os.replace(temp_path, journal_path)
+
+
 # **********************************************************************************************************
 
 
 # **********************************************************************************************************
-def start_bin_merge(cuefile, game_name, outdir):
-    cue_map = read_cue_file(cuefile)
-    cuesheet = gen_merged_cuesheet(game_name, cue_map)
+# cue is the already parsed model of cuefile, it is parsed here when the caller does not have one
+def start_bin_merge(cuefile, game_name, outdir, in_place=False, cue=None):
+    if cue is None:
+        cue = parse_cue(cuefile)
+    cue_map = cue.files
+
+    if in_place:
+        # outdir is not used, the merge happens next to the original cue sheet
+        return merge_files_in_place(cue, game_name)
+
+    cuesheet = gen_merged_cuesheet(game_name, cue_map, cue.blocksize)
 
     if not exists(outdir):
         _log_error('ERROR', 'Output dir does not exist')
@@ -0,0 +1,243 @@
+"""
+Cover art transcoding for devices other than PSIO
+
+The covers.psio blobs are PSIO ready BMPs. Other targets get a copy resampled to their own size and pixel format,
+stored in a content-addressed cache keyed by the blob hash and the profile, so a cover is only transcoded once no
+matter how many cards it is exported to. NumPy is used for the resampling when it is installed.
+"""
+import hashlib
+import logging
+import struct
+import threading
+from dataclasses import dataclass
+from os import makedirs, remove, replace
+from os.path import join, exists
+
+from psio_sdcardmanager.db import application_root
+
+COVER_CACHE_PATH = join(application_root(), 'cover_cache')
+
+logger = logging.getLogger(__name__)
+
+
+class CoverError(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class CoverProfile:
+    name: str
+    width: int
+    height: int
+    # 24 (BGR888) or 16 (RGB555)
+    bits_per_pixel: int = 24
+    # The stored blob is copied as it is
+    passthrough: bool = False
+
+    @property
+    def cache_key(self):
+        return f'{self.name}-{self.width}x{self.height}-{self.bits_per_pixel}'
+
+
+COVER_PROFILES = {
+    'psio': CoverProfile('psio', 80, 84, passthrough=True),
+    # Twice the PSIO size, for menus that show a larger cover (adjust here for other front-ends)
+    'xstation': CoverProfile('xstation', 160, 168),
+    'xstation-16bit': CoverProfile('xstation-16bit', 160, 168, bits_per_pixel=16),
+}
+DEFAULT_COVER_PROFILE = 'psio'
+
+
+# Pixels are kept as a flat bytearray of RGB triplets, top row first
+@dataclass(slots=True)
+class Image:
+    width: int
+    height: int
+    pixels: bytearray
+
+
+# *****************************************************************************************************************
+# Function that decodes an uncompressed 8, 24 or 32 bit BMP
+def decode_bmp(data):
+    if len(data) < 54 or data[:2] != b'BM':
+        raise CoverError('Not a BMP file')
+
+    pixel_offset = struct.unpack_from('<I', data, 10)[0]
+    header_size, width, height, _, bits_per_pixel, compression = struct.unpack_from('<IiiHHI', data, 14)
+    colours_used = struct.unpack_from('<I', data, 46)[0]
+    # Only BI_RGB, bit field (compression 3) BMPs can store the channels in any order
+    if compression != 0 or bits_per_pixel not in (8, 24, 32):
+        raise CoverError(f'Unsupported BMP: {bits_per_pixel} bits per pixel, compression {compression}')
+    if width <= 0 or height == 0:
+        raise CoverError(f'Invalid BMP size: {width}x{height}')
+
+    top_down = height < 0
+    height = abs(height)
+    row_size = (width * bits_per_pixel + 31) // 32 * 4
+    if pixel_offset + row_size * height > len(data):
+        raise CoverError('Truncated BMP file')
+
+    palette = None
+    if bits_per_pixel == 8:
+        palette_offset = 14 + header_size
+        palette_size = colours_used or 256
+        if palette_size > 256 or palette_offset + palette_size * 4 > pixel_offset:
+            raise CoverError('Invalid BMP palette')
+        palette = [data[palette_offset + i * 4:palette_offset + i * 4 + 3][::-1] for i in range(palette_size)]
+
+    bytes_per_pixel = bits_per_pixel // 8
+    pixels = bytearray(width * height * 3)
+    for y in range(height):
+        source_row = y if top_down else height - 1 - y
+        row = data[pixel_offset + source_row * row_size:pixel_offset + source_row * row_size + width * bytes_per_pixel]
+        target = y * width * 3
+        if palette is not None:
+            if max(row) >= len(palette):
+                raise CoverError('BMP colour index outside of its palette')
+            pixels[target:target + width * 3] = b''.join(palette[index] for index in row)
+        else:
+            # BGR(A) to RGB
+            pixels[target + 0:target + width * 3:3] = row[2::bytes_per_pixel]
+            pixels[target + 1:target + width * 3:3] = row[1::bytes_per_pixel]
+            pixels[target + 2:target + width * 3:3] = row[0::bytes_per_pixel]
+
+    return Image(width, height, pixels)
+
+
+# *****************************************************************************************************************
+# Function that encodes an image as a bottom-up 24 bit (BGR888) or 16 bit (RGB555) BMP
+def encode_bmp(image, bits_per_pixel=24):
+    if bits_per_pixel not in (16, 24):
+        raise CoverError(f'Unsupported output format: {bits_per_pixel} bits per pixel')
+
+    width, height, pixels = image.width, image.height, image.pixels
+    row_size = (width * bits_per_pixel + 31) // 32 * 4
+    padding = bytes(row_size - width * bits_per_pixel // 8)
+
+    rows = []
+    for y in range(height - 1, -1, -1):
+        rgb = pixels[y * width * 3:(y + 1) * width * 3]
+        if bits_per_pixel == 24:
+            row = bytearray(width * 3)
+            row[0::3] = rgb[2::3]
+            row[1::3] = rgb[1::3]
+            row[2::3] = rgb[0::3]
+        else:
+            row = struct.pack(f'<{width}H', *[(rgb[i] >> 3) << 10 | (rgb[i + 1] >> 3) << 5 | rgb[i + 2] >> 3
+                                              for i in range(0, width * 3, 3)])
+        rows.append(bytes(row) + padding)
+
+    pixel_data = b''.join(rows)
+    file_header = struct.pack('<2sIHHI', b'BM', 54 + len(pixel_data), 0, 0, 54)
+    info_header = struct.pack('<IiiHHIIiiII', 40, width, height, 1, bits_per_pixel, 0, len(pixel_data), 2835, 2835,
+                              0, 0)
+    return file_header + info_header + pixel_data
+
+
+# *****************************************************************************************************************
+# Function that resamples an image to the given size with bilinear filtering
+def resize_image(image, width, height):
+    if (image.width, image.height) == (width, height):
+        return image
+
+    numpy = _import_numpy()
+    if numpy is not None:
+        return _resize_image_numpy(numpy, image, width, height)
+
+    x_samples = _bilinear_samples(image.width, width)
+    pixels = bytearray(width * height * 3)
+    source = image.pixels
+    source_stride = image.width * 3
+
+    for y, (y0, y1, y_weight) in enumerate(_bilinear_samples(image.height, height)):
+        row0 = y0 * source_stride
+        row1 = y1 * source_stride
+        target = y * width * 3
+        for x0, x1, x_weight in x_samples:
+            for channel in range(3):
+                top = source[row0 + x0 * 3 + channel] * (1 - x_weight) + source[row0 + x1 * 3 + channel] * x_weight
+                bottom = source[row1 + x0 * 3 + channel] * (1 - x_weight) + source[row1 + x1 * 3 + channel] * x_weight
+                pixels[target] = int(top * (1 - y_weight) + bottom * y_weight + 0.5)
+                target += 1
+
+    return Image(width, height, pixels)
+
+
+# For each target position the two source positions to blend and the weight of the second, sampling pixel centres
+def _bilinear_samples(source_size, target_size):
+    samples = []
+    scale = source_size / target_size
+    for target in range(target_size):
+        position = min(max((target + 0.5) * scale - 0.5, 0), source_size - 1)
+        low = int(position)
+        samples.append((low, min(low + 1, source_size - 1), position - low))
+    return samples
+
+
+def _resize_image_numpy(numpy, image, width, height):
+    source = numpy.frombuffer(bytes(image.pixels), dtype=numpy.uint8).reshape(image.height, image.width, 3)
+    source = source.astype(numpy.float32)
+
+    x0, x1, x_weight = (numpy.array(values) for values in zip(*_bilinear_samples(image.width, width)))
+    y0, y1, y_weight = (numpy.array(values) for values in zip(*_bilinear_samples(image.height, height)))
+    x_weight = x_weight.astype(numpy.float32)[None, :, None]
+    y_weight = y_weight.astype(numpy.float32)[:, None, None]
+
+    top = source[y0][:, x0] * (1 - x_weight) + source[y0][:, x1] * x_weight
+    bottom = source[y1][:, x0] * (1 - x_weight) + source[y1][:, x1] * x_weight
+    pixels = numpy.clip(top * (1 - y_weight) + bottom * y_weight + 0.5, 0, 255).astype(numpy.uint8)
+    return Image(width, height, bytearray(pixels.tobytes()))
+
+
+# NumPy is optional and only imported the first time a cover is resized
+_numpy = None
+
+
+def _import_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+# *****************************************************************************************************************
+# Function that converts a stored cover to a profile
+def transcode_cover(cover_data, profile):
+    if profile.passthrough:
+        return bytes(cover_data)
+    image = resize_image(decode_bmp(cover_data), profile.width, profile.height)
+    return encode_bmp(image, profile.bits_per_pixel)
+
+
+# Content-addressed store of transcoded covers: <cache>/<first two hex digits>/<sha256 of the blob>-<profile>.bmp
+class CoverCache:
+    def __init__(self, cache_path=COVER_CACHE_PATH):
+        self.cache_path = cache_path
+
+    def path(self, cover_hash, profile):
+        return join(self.cache_path, cover_hash[:2], f'{cover_hash}-{profile.cache_key}.bmp')
+
+    # Returns the cached file for a cover, transcoding it first if it is not in the cache yet
+    def get(self, cover_data, profile, cover_hash=None):
+        cover_hash = cover_hash or hashlib.sha256(cover_data).hexdigest()
+        cached_path = self.path(cover_hash, profile)
+        if exists(cached_path):
+            return cached_path
+
+        transcoded = transcode_cover(cover_data, profile)
+
+        # Each thread writes its own temp file, two exports of the same cover then both rename a complete file
+        makedirs(join(self.cache_path, cover_hash[:2]), exist_ok=True)
+        temp_path = f'{cached_path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as cache_file:
+                cache_file.write(transcoded)
+            replace(temp_path, cached_path)
+        finally:
+            if exists(temp_path):
+                remove(temp_path)
+        return cached_path
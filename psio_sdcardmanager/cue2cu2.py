@@ -26,38 +26,29 @@
 from os import remove
 from os.path import exists, join, getsize
 from pathlib import Path
-from re import compile
 
 import logging
+
+from psio_sdcardmanager.cue_parser import parse_cue, ZeroBinFilesException, BinFilesMissingException
 # Global variables
 error_log_path = None
 
+# Two seconds (150 sectors) offset PSIO expects on every position, and the highest position a timecode can hold
+PSIO_OFFSET_SECTORS = 2 * 75
+MAX_SECTORS = 449999
+
 logger = logging.getLogger(__name__)
 
-# **********************************************************************************************************
-# Function to convert timecode/index position to sector count
-def _convert_timecode_to_sectors(timecode):
-    minutes = int(timecode[0:2])
-    seconds = int(timecode[3:5])
-    sectors = int(timecode[6:8])
-    minutes_sectors = int(minutes * 60 * 75)
-    seconds_sectors = int(seconds * 75)
-    total_sectors = int(minutes_sectors + seconds_sectors + sectors)
-    return total_sectors
-
-
-# **********************************************************************************************************
 
+class Cu2Error(Exception):
+    pass
 
 # **********************************************************************************************************
 # Function to convert sectors to timcode
 def _convert_sectors_to_timecode(sectors):
-    total_seconds = int(int(sectors) / 75)
-    modulo_sectors = int(int(sectors) % 75)
-    total_minutes = int(total_seconds / 60)
-    modulo_seconds = int(total_seconds % 60)
-    timecode = f'{str(total_minutes).zfill(2)}:{str(modulo_seconds).zfill(2)}:{str(modulo_sectors).zfill(2)}'
-    return timecode
+    total_seconds, modulo_sectors = divmod(sectors, 75)
+    total_minutes, modulo_seconds = divmod(total_seconds, 60)
+    return '%02d:%02d:%02d' % (total_minutes, modulo_seconds, modulo_sectors)
 
 
 # **********************************************************************************************************
@@ -66,19 +57,26 @@ def _convert_sectors_to_timecode(sectors):
 # **********************************************************************************************************
 # Function to convert sectors to timcode - but use MM:SS-1:75 instead of MM:SS:00. Thanks for finding that oddity, bikerspade!
 def _convert_sectors_to_timecode_with_alternative_notation(sectors):
-    total_seconds = int(int(sectors) / 75)
-    modulo_sectors = int(int(sectors) % 75)
-    total_minutes = int(total_seconds / 60)
-    modulo_seconds = int(total_seconds % 60)
+    total_seconds, modulo_sectors = divmod(sectors, 75)
+    total_minutes, modulo_seconds = divmod(total_seconds, 60)
     if modulo_sectors == 0:
-        modulo_sectors = int(75)
+        modulo_sectors = 75
         if modulo_seconds != 0:
             modulo_seconds = modulo_seconds - 1
         else:
             modulo_seconds = 59
             total_minutes = total_minutes - 1
-    timecode = f'{str(total_minutes).zfill(2)}:{str(modulo_seconds).zfill(2)}:{str(modulo_sectors).zfill(2)}'
-    return timecode
+    return '%02d:%02d:%02d' % (total_minutes, modulo_seconds, modulo_sectors)
+
+
+# **********************************************************************************************************
+
+
+# **********************************************************************************************************
+# Function to add the famous two second offset for PSIO to a position and convert it to the alternative notation
+# used by Systems Console for tracks
+def _convert_sectors_to_psio_position(sectors):
+    return _convert_sectors_to_timecode_with_alternative_notation(min(sectors + PSIO_OFFSET_SECTORS, MAX_SECTORS))
 
 
 # **********************************************************************************************************
@@ -88,7 +86,7 @@ def _convert_sectors_to_timecode_with_alternative_notation(sectors):
 # Function to get the total runtime timecode for a given filesize
 def _convert_bytes_to_sectors(filesize):
     if filesize % 2352 == 0:
-        return int(int(filesize) / 2352)
+        return filesize // 2352
 
 
 # **********************************************************************************************************
@@ -104,18 +102,6 @@ def _convert_filesize_to_sectors(binaryfile):
 # **********************************************************************************************************
 
 
-# **********************************************************************************************************
-# Function to add two timecodes together
-def _timecode_addition(timecode, offset):
-    result = _convert_timecode_to_sectors(timecode) + _convert_timecode_to_sectors(offset)
-    if result > int('449999'):
-        result = int('449999')
-    return _convert_sectors_to_timecode(result)
-
-
-# **********************************************************************************************************
-
-
 # **********************************************************************************************************
 # Function to log basic error messages to a file
 def _log_error(error_type, error_message):
@@ -144,135 +130,146 @@ def set_cu2_error_log_path(log_path):
 # **********************************************************************************************************
 # SCRIPT START
 # **********************************************************************************************************
-def start_cue2cu2(cuesheet, binaryfile_name):
-    # Hardcoded for CU2 revision 2
-    format_revision = int(2)
+# cue is the already parsed cue_parser.Cue model of the cue sheet, it is parsed here when the caller does not have one.
+# When a binmerge.VirtualDisc is given, a multi-bin game is converted as if it had been merged into
+# binaryfile_name: the track positions and size come from the virtual image and the original cue sheet is kept.
+def start_cue2cu2(cuesheet, binaryfile_name, virtual_disc=None, cue=None):
+    bin_path = str(Path(cuesheet).parent)
+    binaryfile = join(bin_path, binaryfile_name)
 
-    # Copy the cue sheet into an array so we don't have to re-read it from disk again and can navigate it easily
     try:
-        with open(cuesheet, 'r') as cuesheet_file:
-            cuesheet_content = cuesheet_file.read().splitlines()
-            cuesheet_file.close()
-    except:
-        _log_error('ERROR', f'Could not open {str(cuesheet)}')
+        output = cue2cu2_bytes(cuesheet, binaryfile_name, virtual_disc, cue)
+    except Cu2Error as error:
+        _log_error('ERROR', str(error))
         return False
 
-    # Check the cue sheet if the image is supposed to be in Mode 2 with 2352 bytes per sector
-    for line in cuesheet_content:
-        cuesheet_mode_valid = bool(False)
-        if compile('.*[Mm][Oo][Dd][Ee]2/2352.*').match(line):
-            cuesheet_mode_valid = bool(True)
-            break
-    if cuesheet_mode_valid == False:  # If it's not, we can't continue
-        _log_error('ERROR', f'Cue sheet {str(cuesheet)} indicates this image is not in MODE2/2352')
+    # *********************************************
+    # We are now ready to output our CU2 sheet
+    # *********************************************
+    cu2sheet = write_cu2(cuesheet, binaryfile_name, output, keep_cue=virtual_disc is not None)
+    if cu2sheet is None:
+        _log_error('ERROR', f'Could not write to: {str(binaryfile[::-1][4:][::-1] + ".cu2")}')
         return False
 
-    bin_path = str(Path(cuesheet).parent)
-    binaryfile = join(bin_path, binaryfile_name)
-    output = str()
+    return True
+# **********************************************************************************************************
+
+
+# **********************************************************************************************************
+# Function that writes a generated CU2 sheet next to its bin file and returns its path (None if it failed)
+# The original CUE file is removed once the CU2 file has been written, unless keep_cue is set
+def write_cu2(cuesheet, binaryfile_name, output, keep_cue=False):
+    binaryfile = join(str(Path(cuesheet).parent), binaryfile_name)
+
+    # Derive the file name from the binary file's filename
+    cu2sheet = binaryfile[::-1][4:][::-1] + '.cu2'
+    try:
+        with open(cu2sheet, 'wb') as cu2file:
+            cu2file.write(output)
+    except OSError:
+        return None
 
-    # Get number of tracks from cue sheet
-    ntracks = 0
-    for line in cuesheet_content:
-        if compile('[ \t]*[Tt][Rr][Aa][Cc][Kk].*').match(line) and not compile(
-                '[ \t]*[Ff][Ii][Ll][Ee].*[Tt][Rr][Aa][Cc][Kk].*').match(line):
-            ntracks += 1
-    output = f'{output}ntracks {str(ntracks)}\r\n'
+    # Remove the original CUE file if the CU2 file has been generated
+    if exists(cu2sheet) and not keep_cue:
+        remove(cuesheet)
 
-    sectors = _convert_filesize_to_sectors(binaryfile)
+    return cu2sheet
+# **********************************************************************************************************
+
+
+# **********************************************************************************************************
+# Function that resolves the cue model and disc size for a cue sheet and returns its CU2 sheet without writing it
+def cue2cu2_bytes(cuesheet, binaryfile_name, virtual_disc=None, cue=None, warnings=None):
+    binaryfile = join(str(Path(cuesheet).parent), binaryfile_name)
+
+    if virtual_disc is not None:
+        cue = virtual_disc.cue
+    elif cue is None:
+        try:
+            cue = parse_cue(cuesheet)
+        except (OSError, ZeroBinFilesException, BinFilesMissingException) as error:
+            raise Cu2Error(f'Could not open {str(cuesheet)}') from error
+
+    # Track positions have to be relative to the start of the single bin file the CU2 sheet describes
+    if len(cue.files) > 1:
+        cue = cue.merged(binaryfile)
+
+    if virtual_disc is not None:
+        sectors = _convert_bytes_to_sectors(virtual_disc.size)
+    else:
+        sectors = _convert_filesize_to_sectors(binaryfile)
 
     if sectors is None:
-        return False
+        raise Cu2Error(f'Bin file {str(binaryfile)} is missing or is not a whole number of 2352 byte sectors')
 
-    # Get the total runtime/size
-    size = _convert_sectors_to_timecode(sectors)
-    output = f'{output}size	   {size}\r\n'
+    return generate_cu2(cue, sectors, warnings)
+# **********************************************************************************************************
 
-    # Get data1 - well, this is always the same for our kind of disc images, so...
-    # At some point I should do this the proper way and grab it from Track 1.
-    data1 = _timecode_addition('00:00:00', '00:02:00')
-    output = f'{output}data1	   {data1}\r\n'
 
-    # Get the track and pregap lengths
-    pregap_command_used_before = bool(False)
-    for track in range(2, ntracks + 1):
-        # Find current track number in cuesheet_content
-        current_track_in_cuesheet = -1;
-        for line in cuesheet_content:
-            current_track_in_cuesheet += 1
-            if compile(f'.*[Tt][Rr][Aa][Cc][Kk] 0?{str(track)}.*').match(line):
-                break
-
-        # See if the next line is index 00, and if so, get and output the pregap if the CU2 format requires it
-        if compile('.*[Ii][Nn][Dd][Ee][Xx] 0?0.*').match(
-                cuesheet_content[current_track_in_cuesheet + 1]) and format_revision == int(2):
-            pregap_position = cuesheet_content[current_track_in_cuesheet + 1][::-1][:8][::-1][:9]
-
-            # Add the famous two second offset for PSIO and convert to alternative notation used by Systems Console for tracks
-            pregap_position = _convert_sectors_to_timecode_with_alternative_notation(
-                _convert_timecode_to_sectors(_timecode_addition(pregap_position, "00:02:00")))
-            output = f'{output}pregap{str(track).zfill(2)}	{pregap_position}\r\n'
+# **********************************************************************************************************
+# Function that generates a CU2 sheet from a cue model in a single pass over its tracks
+#
+# sectors is the total size of the bin file the CU2 sheet describes. Problems that stop the conversion raise
+# Cu2Error, warnings are appended to the warnings list when one is given and logged otherwise.
+def generate_cu2(cue, sectors, warnings=None):
+    # Hardcoded for CU2 revision 2
+    format_revision = 2
 
-        # Check if this cue sheet uses the PREGAP command, which is bad. We can continue, but...
-        elif compile('.*[Pp][Rr][Ee][Gg][Aa][Pp].*').match(
-                cuesheet_content[current_track_in_cuesheet + 1]) and format_revision == int(2):
-            if pregap_command_used_before == False:
-                _log_error('WARNING',
-                           f'The PREGAP command is used for track {str(track)}, which requires the software to insert data into the image or disc. This is not supported by Cue2cu2. The pregap will be ignored and a zero length pregap will be noted in the CU2 sheet in order to continue, but the resulting bin/CU2 set might not work as expected or not at all. If possible, please try a Redump compatible version of this image')
-                pregap_command_used_before = bool(True)
-            elif pregap_command_used_before == True:
-                _log_error('WARNING', f'The PREGAP command is also used for track {str(track)}.')
-            if compile('.*[Ii][Nn][Dd][Ee][Xx] 0?1.*').match(cuesheet_content[current_track_in_cuesheet + 2]):
-                pregap_position = cuesheet_content[current_track_in_cuesheet + 2][::-1][:8][::-1][:9]
-
-                # Add the famous two second offset for PSIO and convert to alternative notation used by Systems Console for tracks
-                pregap_position = _convert_sectors_to_timecode_with_alternative_notation(
-                    _convert_timecode_to_sectors(_timecode_addition(pregap_position, "00:02:00")))
-                output = f'{output}pregap{str(track).zfill(2)}	{pregap_position}\r\n'
-
-        elif format_revision == int(2):
-            _log_error('ERROR',
-                       f'Could not find pregap position (index 00) for track {str(track)} in cue sheet: {str(cuesheet)}')
-            return False
-
-        # Else-If is it index 01? If so, output track start, or get it from the following line
-        if compile('.*[Ii][Nn][Dd][Ee][Xx] 0?1.*').match(cuesheet_content[current_track_in_cuesheet + 1]):
-            track_position = cuesheet_content[current_track_in_cuesheet + 1][::-1][:8][::-1][
-                             :9]  # I have no idea what I'm doing
-        elif compile('.*[Ii][Nn][Dd][Ee][Xx] 0?1.*').match(cuesheet_content[current_track_in_cuesheet + 2]):
-            track_position = cuesheet_content[current_track_in_cuesheet + 2][::-1][:8][::-1][:9]
+    def warn(message):
+        if warnings is not None:
+            warnings.append(message)
         else:
-            _log_error('ERROR',
-                       f'Could not find starting position (index 01) for track {str(track)} in cue sheet: {str(cuesheet)}')
-            return False
+            _log_error('WARNING', message)
 
-        # Add the famous two second offset for PSIO and convert to alternative notation used by Systems Console for tracks
-        track_position = _convert_sectors_to_timecode_with_alternative_notation(
-            _convert_timecode_to_sectors(_timecode_addition(track_position, "00:02:00")))
-        output = f'{output}track{str(track).zfill(2)}	{track_position}\r\n'
+    # Check the cue sheet if the image is supposed to be in Mode 2 with 2352 bytes per sector
+    tracks = cue.tracks
+    if not any(track.track_type.upper() == 'MODE2/2352' for track in tracks):
+        raise Cu2Error(f'Cue sheet {str(cue.path)} indicates this image is not in MODE2/2352')
+
+    output = [
+        # Get number of tracks from cue sheet
+        f'ntracks {len(tracks)}\r\n',
+        # Get the total runtime/size
+        f'size	   {_convert_sectors_to_timecode(sectors)}\r\n',
+        # Get data1 - well, this is always the same for our kind of disc images, so...
+        # At some point I should do this the proper way and grab it from Track 1.
+        f'data1	   {_convert_sectors_to_timecode(PSIO_OFFSET_SECTORS)}\r\n',
+    ]
 
-    # Add the end for the last track
-    track_end = _convert_sectors_to_timecode_with_alternative_notation(
-        _convert_timecode_to_sectors(_timecode_addition(size, '00:02:00')))
-    output = f'{output}\r\ntrk end	 {track_end}'
+    # Get the track and pregap lengths
+    pregap_command_used_before = False
+    for cue_track in tracks[1:]:
+        track = cue_track.num
+        index_00 = cue_track.index(0)
+        index_01 = cue_track.index(1)
 
-    # *********************************************
-    # We are now ready to output our CU2 sheet
-    # *********************************************
+        # See if the track has an index 00, and if so, get and output the pregap if the CU2 format requires it
+        if index_00 is not None and format_revision == 2:
+            output.append(f'pregap{track:02d}	{_convert_sectors_to_psio_position(index_00.file_offset)}\r\n')
 
-    # Derive the file name from the binary file's filename
-    cu2sheet = binaryfile[::-1][4:][::-1] + '.cu2'
-    try:
-        cu2file = open(cu2sheet, 'wb')
-        cu2file.write(output.encode())
-        cu2file.close
-    except:
-        _log_error('ERROR', f'Could not write to: {str(cu2sheet)}')
-        return False
+        # Check if this cue sheet uses the PREGAP command, which is bad. We can continue, but...
+        elif cue_track.pregap is not None and format_revision == 2:
+            if not pregap_command_used_before:
+                warn(f'The PREGAP command is used for track {str(track)}, which requires the software to insert data into the image or disc. This is not supported by Cue2cu2. The pregap will be ignored and a zero length pregap will be noted in the CU2 sheet in order to continue, but the resulting bin/CU2 set might not work as expected or not at all. If possible, please try a Redump compatible version of this image')
+                pregap_command_used_before = True
+            else:
+                warn(f'The PREGAP command is also used for track {str(track)}.')
+            if index_01 is not None:
+                output.append(f'pregap{track:02d}	{_convert_sectors_to_psio_position(index_01.file_offset)}\r\n')
+
+        # Without an index 00 the track has no pregap, so it is noted as starting where the track does (index 01)
+        elif format_revision == 2:
+            warn(f'Could not find pregap position (index 00) for track {str(track)} in cue sheet: {str(cue.path)}, a zero length pregap will be noted in the CU2 sheet')
+            if index_01 is not None:
+                output.append(f'pregap{track:02d}	{_convert_sectors_to_psio_position(index_01.file_offset)}\r\n')
+
+        # Output the track start (index 01)
+        if index_01 is None:
+            raise Cu2Error(f'Could not find starting position (index 01) for track {str(track)} in cue sheet: {str(cue.path)}')
+        output.append(f'track{track:02d}	{_convert_sectors_to_psio_position(index_01.file_offset)}\r\n')
 
-    # Remove the original CUE file if the CU2 file has been generated
-    if exists(cu2sheet):
-        remove(cuesheet)
+    # Add the end for the last track
+    output.append(f'\r\ntrk end	 {_convert_sectors_to_psio_position(sectors)}')
 
-    return True
+    return ''.join(output).encode()
 # **********************************************************************************************************
@@ -0,0 +1,193 @@
+"""
+Single-pass cue sheet parser
+
+The cue sheet is read once into an immutable Cue model which is then shared by binmerge, cue2cu2 and GameHandler.
+"""
+import logging
+import os
+import re
+from dataclasses import dataclass, replace
+
+logger = logging.getLogger(__name__)
+
+FILE_REGEX = re.compile(r'FILE "?(.*?)"? BINARY', re.IGNORECASE)
+TRACK_REGEX = re.compile(r'TRACK (\d+) ([^\s]*)', re.IGNORECASE)
+INDEX_REGEX = re.compile(r'INDEX (\d+) (\d+):(\d+):(\d+)', re.IGNORECASE)
+PREGAP_REGEX = re.compile(r'PREGAP (\d+):(\d+):(\d+)', re.IGNORECASE)
+
+# All possible blocksize types. You cannot mix types on a disc, so the first one seen is used for the whole cue.
+#
+# AUDIO – Audio/Music (2352)
+# CDG – Karaoke CD+G (2448)
+# MODE1/2048 – CDROM Mode1 Data (cooked)
+# MODE1/2352 – CDROM Mode1 Data (raw)
+# MODE2/2336 – CDROM-XA Mode2 Data
+# MODE2/2352 – CDROM-XA Mode2 Data
+# CDI/2336 – CDI Mode2 Data
+# CDI/2352 – CDI Mode2 Data
+BLOCKSIZES = {
+    'AUDIO': 2352,
+    'MODE1/2352': 2352,
+    'MODE2/2352': 2352,
+    'CDI/2352': 2352,
+    'CDG': 2448,
+    'MODE1/2048': 2048,
+    'MODE2/2336': 2336,
+    'CDI/2336': 2336,
+}
+DEFAULT_BLOCKSIZE = 2352
+
+# 75 sectors per second
+SECTORS_PER_SECOND = 75
+SECTORS_PER_MINUTE = 60 * SECTORS_PER_SECOND
+
+
+class ZeroBinFilesException(Exception):
+    pass
+
+
+class BinFilesMissingException(Exception):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class CueIndex:
+    id: int
+    stamp: str
+    file_offset: int
+
+
+@dataclass(frozen=True, slots=True)
+class CueTrack:
+    num: int
+    track_type: str
+    indexes: tuple
+    # Length of a PREGAP command in sectors, None when the track has no PREGAP command
+    pregap: int | None = None
+    # Only known when every track lives in a single file
+    sectors: int | None = None
+
+    def index(self, index_id):
+        for index in self.indexes:
+            if index.id == index_id:
+                return index
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class CueFile:
+    filename: str
+    size: int
+    tracks: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class Cue:
+    path: str
+    files: tuple
+    blocksize: int
+
+    @property
+    def tracks(self):
+        return tuple(track for cue_file in self.files for track in cue_file.tracks)
+
+    @property
+    def size(self):
+        return sum(cue_file.size for cue_file in self.files)
+
+    # Returns the model the cue would have once its bin files are merged into bin_path, with every index position
+    # made relative to the start of the merged image
+    def merged(self, bin_path, cue_path=None):
+        tracks = []
+        sector_pos = 0
+        for cue_file in self.files:
+            for track in cue_file.tracks:
+                indexes = tuple(CueIndex(index.id, sectors_to_cuestamp(sector_pos + index.file_offset),
+                                         sector_pos + index.file_offset) for index in track.indexes)
+                tracks.append(replace(track, indexes=indexes, sectors=None))
+            sector_pos += cue_file.size // self.blocksize
+
+        merged_file = _with_track_sectors(CueFile(bin_path, self.size, tuple(tracks)), self.blocksize)
+        return Cue(cue_path or self.path, (merged_file,), self.blocksize)
+
+
+def parse_cue(cue_path):
+    files = []
+    this_file = None
+    this_track = None
+    blocksize = None
+    bin_files_missing = False
+
+    with open(cue_path, 'r') as cue_file:
+        lines = cue_file.read().splitlines()
+
+    for line in lines:
+        m = FILE_REGEX.search(line)
+        if m:
+            this_path = os.path.join(os.path.dirname(cue_path), m.group(1))
+            if not (os.path.isfile(this_path) or os.access(this_path, os.R_OK)):
+                logging.log(logging.ERROR, f'Bin file not found or not readable: {this_path}')
+                bin_files_missing = True
+            else:
+                this_file = {'filename': this_path, 'size': os.path.getsize(this_path), 'tracks': []}
+                files.append(this_file)
+            this_track = None
+            continue
+
+        m = TRACK_REGEX.search(line)
+        if m and this_file:
+            this_track = {'num': int(m.group(1)), 'track_type': m.group(2), 'indexes': [], 'pregap': None}
+            this_file['tracks'].append(this_track)
+            if blocksize is None:
+                blocksize = BLOCKSIZES.get(m.group(2).upper())
+            continue
+
+        m = INDEX_REGEX.search(line)
+        if m and this_track:
+            minutes, seconds, fields = int(m.group(2)), int(m.group(3)), int(m.group(4))
+            this_track['indexes'].append(CueIndex(int(m.group(1)), f'{m.group(2)}:{m.group(3)}:{m.group(4)}',
+                                                  timecode_to_sectors(minutes, seconds, fields)))
+            continue
+
+        m = PREGAP_REGEX.search(line)
+        if m and this_track:
+            this_track['pregap'] = timecode_to_sectors(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            continue
+
+    if bin_files_missing:
+        raise BinFilesMissingException
+
+    if not len(files):
+        raise ZeroBinFilesException
+
+    blocksize = blocksize or DEFAULT_BLOCKSIZE
+    cue_files = tuple(CueFile(f['filename'], f['size'],
+                              tuple(CueTrack(t['num'], t['track_type'], tuple(t['indexes']), t['pregap'])
+                                    for t in f['tracks'])) for f in files)
+
+    if len(cue_files) == 1:
+        # only 1 file, calc sectors of each track
+        cue_files = (_with_track_sectors(cue_files[0], blocksize),)
+
+    return Cue(cue_path, cue_files, blocksize)
+
+
+def _with_track_sectors(cue_file, blocksize):
+    tracks = []
+    next_item_offset = cue_file.size // blocksize
+    for track in reversed(cue_file.tracks):
+        if not track.indexes:
+            return cue_file
+        tracks.insert(0, replace(track, sectors=next_item_offset - track.indexes[0].file_offset))
+        next_item_offset = track.indexes[0].file_offset
+    return replace(cue_file, tracks=tuple(tracks))
+
+
+def timecode_to_sectors(minutes, seconds, fields):
+    return fields + seconds * SECTORS_PER_SECOND + minutes * SECTORS_PER_MINUTE
+
+
+def sectors_to_cuestamp(sectors):
+    minutes, remainder = divmod(sectors, SECTORS_PER_MINUTE)
+    seconds, fields = divmod(remainder, SECTORS_PER_SECOND)
+    return '%02d:%02d:%02d' % (minutes, seconds, fields)
@@ -1,55 +1,123 @@
 """
 Sqlite3 database functions
 """
+import hashlib
 import logging
 # System imports
 import sys
-from os import remove
-from os.path import exists, join, abspath, dirname
+from contextlib import contextmanager
+from csv import DictReader
+from os import remove, replace
+from os.path import exists, join, abspath, dirname, getsize, basename
 from pathlib import Path
+from queue import Queue, Empty, Full
+from shutil import copyfileobj
 from sqlite3 import connect, Error
 
-DATABASE_PATH = join(Path(abspath(dirname(sys.argv[0]))), 'data')
+
+# Function that finds the directory the application data lives in: next to the launched script, or the project
+# directory when the package itself is run with python -m psio_sdcardmanager
+def application_root():
+    script_dir = Path(abspath(dirname(sys.argv[0])))
+    if script_dir == Path(abspath(dirname(__file__))):
+        return script_dir.parent
+    return script_dir
+
+
+DATABASE_PATH = join(application_root(), 'data')
 DATABASE_FILE = 'psio_assist.db'
 DATABASE_FULL_PATH = join(DATABASE_PATH, DATABASE_FILE)
+DATABASE_MANIFEST_FILE = 'fs_manifest.csv'
+
+# Idle read-only connections are kept here and handed out to whichever thread needs one next
+DATABASE_POOL_SIZE = 8
+DATABASE_CACHED_STATEMENTS = 256
+# Stay under SQLite's default limit on host parameters per statement
+SQLITE_MAX_VARIABLES = 900
+_connection_pool = Queue(maxsize=DATABASE_POOL_SIZE)
+
+# Covers are streamed out of the database in chunks of this size, into a temp file with this suffix
+COVER_CHUNK_SIZE = 64 * 1024
+TEMP_FILE_SUFFIX = '.tmp'
+
+# The split-files are concatenated in chunks of this size, the result has to start with the SQLite file header
+DATABASE_MERGE_CHUNK_SIZE = 1024 * 1024
+SQLITE_HEADER = b'SQLite format 3\0'
+
+# Stored in PRAGMA user_version once the merged database has been indexed and compacted
+DATABASE_LAYOUT_VERSION = 1
+
+# Covering indexes for the lookups GameHandler makes, so metadata queries are answered from the index alone and
+# never have to walk the table pages holding the cover blobs
+DATABASE_INDEXES = [
+    ('games_game_id_index', 'games', 'game_id, name, disc_number'),
+    ('covers_game_id_index', 'covers', 'game_id, id'),
+]
 
 logger = logging.getLogger(__name__)
 
 
+class DatabaseUnavailableError(Exception):
+    pass
+
+
 # Function that ensures the database file exists and has been merged
-def ensure_database_exists():
+# Raises DatabaseUnavailableError when there is no database and it cannot be merged from the split-files
+def ensure_database_exists(progress_callback=None):
     if not exists(DATABASE_FULL_PATH):
         if _database_splits_exist():
-            _merge_database()
+            _merge_database(progress_callback)
             if not exists(DATABASE_FULL_PATH):
-                logging.log(logging.ERROR, 'Unable to merge database file!')
-                sys.exit()
+                raise DatabaseUnavailableError('Unable to merge database file!')
         else:
-            logging.log(logging.ERROR, 'Database split-files not found!')
-            sys.exit()
+            raise DatabaseUnavailableError('Database split-files not found!')
+    elif _database_layout_version() < DATABASE_LAYOUT_VERSION:
+        # Databases merged by older versions have no indexes yet
+        _optimise_database()
 
 
-def select(select_query):
+def select(select_query, params=()):
     rows = []
     try:
-        conn = _create_connection(DATABASE_FULL_PATH)
-        cursor = conn.cursor()
-        cursor.execute(select_query)
-        rows = cursor.fetchall()
-        cursor.close()
+        with _pooled_connection() as conn:
+            rows = conn.execute(select_query, params).fetchall()
     except Error as error:
         logging.log(logging.ERROR, error)
-    finally:
-        if conn:
-            conn.close()
 
     return rows
 
 
-def _create_connection(db_file):
+# Function that looks up the name, disc number and cover id of many games using one query per table
+def select_game_metadata(game_ids):
+    game_ids = list(dict.fromkeys(game_id for game_id in game_ids if game_id))
+    metadata = {}
+
+    for start in range(0, len(game_ids), SQLITE_MAX_VARIABLES):
+        chunk = game_ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ', '.join('?' * len(chunk))
+
+        for game_id, name, disc_number in select(
+                f'SELECT game_id, name, disc_number FROM games WHERE game_id IN ({placeholders}) ORDER BY rowid;', chunk):
+            metadata.setdefault(game_id, {'name': name, 'disc_number': disc_number, 'cover_id': None})
+
+        for game_id, cover_id in select(
+                f'SELECT game_id, id FROM covers WHERE game_id IN ({placeholders}) ORDER BY rowid;', chunk):
+            game_metadata = metadata.setdefault(game_id, {'name': None, 'disc_number': 0, 'cover_id': None})
+            if game_metadata['cover_id'] is None:
+                game_metadata['cover_id'] = cover_id
+
+    return metadata
+
+
+def _create_connection(db_file, read_only=False):
     conn = None
     try:
-        conn = connect(db_file)
+        if read_only:
+            # Open through a URI so a missing database raises instead of silently creating an empty file
+            conn = connect(f'{Path(db_file).as_uri()}?mode=ro', uri=True, check_same_thread=False,
+                           cached_statements=DATABASE_CACHED_STATEMENTS)
+        else:
+            conn = connect(db_file)
         return conn
     except Error as error:
         logging.log(logging.ERROR, error)
@@ -57,88 +125,269 @@ def _create_connection(db_file):
     return conn
 
 
-def extract_game_cover_blob(row_id, image_out_path):
+# Context manager that borrows a connection from the pool and returns it once the caller is done
+@contextmanager
+def _pooled_connection():
     try:
-        conn = _create_connection(DATABASE_FULL_PATH)
-        cursor = conn.cursor()
+        conn = _connection_pool.get_nowait()
+    except Empty:
+        conn = _create_connection(DATABASE_FULL_PATH, read_only=True)
+        if conn is None:
+            raise Error(f'Unable to open database: {DATABASE_FULL_PATH}')
 
-        with open(image_out_path, 'wb') as output_file:
-            cursor.execute(f'SELECT psio FROM covers WHERE id = {row_id};')
-            ablob = cursor.fetchone()
-            output_file.write(ablob[0])
+    try:
+        yield conn
+    finally:
+        try:
+            _connection_pool.put_nowait(conn)
+        except Full:
+            conn.close()
+
+
+# Function that closes every idle pooled connection (e.g. before the database file is replaced)
+def close_connections():
+    while True:
+        try:
+            _connection_pool.get_nowait().close()
+        except Empty:
+            break
+
+
+# Function that streams a cover blob into a file with incremental blob I/O, memory use does not depend on its size
+def _stream_cover_blob(conn, row_id, destination):
+    def copy_blob(output_file):
+        with conn.blobopen('covers', 'psio', row_id, readonly=True) as blob:
+            while chunk := blob.read(COVER_CHUNK_SIZE):
+                output_file.write(chunk)
+
+    return _write_atomically(destination, copy_blob)
+
+
+# Function that writes a file through a temp file next to it and renames it into place once it is complete
+def _write_atomically(destination, write_function):
+    temp_path = f'{destination}{TEMP_FILE_SUFFIX}'
+    try:
+        with open(temp_path, 'wb') as output_file:
+            write_function(output_file)
+        replace(temp_path, destination)
+    except (OSError, Error) as error:
+        logging.log(logging.ERROR, error)
+        if exists(temp_path):
+            remove(temp_path)
+        return False
+    return True
+
+
+# Function that writes the covers of many games at once, cover_requests is a list of (game_id, destination path)
+#
+# The cover rows are found with one query per SQLITE_MAX_VARIABLES games. Every distinct cover is then streamed once
+# from the database by a worker with its own pooled connection, discs that share a cover get a copy of the written
+# file. aliases is the {serial: canonical serial} map of the multi-disc sets (multidisc.load_disc_aliases): the discs of
+# a set share the cover of its canonical serial, so the set's cover is only read once (a disc falls back to its own
+# cover when the canonical serial has none). With a cover_profile that is not a passthrough (e.g. Xstation) the discs
+# get a copy of the transcoded cover from cover_cache (a covers.CoverCache) instead, so a cover already transcoded on
+# an earlier run is never decoded again. Returns the destination paths that were written.
+def export_game_covers(cover_requests, max_workers=DATABASE_POOL_SIZE, cover_profile=None, cover_cache=None,
+                       aliases=None):
+    from concurrent.futures import ThreadPoolExecutor
 
-        cursor.close()
+    aliases = aliases or {}
+    destinations = {}
+    for game_id, destination in cover_requests:
+        destinations.setdefault(game_id, []).append(destination)
+    game_ids = list(set(destinations) | {aliases[game_id] for game_id in destinations if game_id in aliases})
+
+    # The first cover of each game that has a PSIO image. This can be a later row than the cover_id
+    # select_game_metadata reports, which is answered from the covers index and never checks the blob.
+    game_cover_rows = {}
+    try:
+        with _pooled_connection() as conn:
+            for start in range(0, len(game_ids), SQLITE_MAX_VARIABLES):
+                chunk = game_ids[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ', '.join('?' * len(chunk))
+                for game_id, row_id in conn.execute(
+                        f'SELECT game_id, rowid FROM covers WHERE game_id IN ({placeholders}) AND psio IS NOT NULL '
+                        f'ORDER BY rowid;', chunk):
+                    game_cover_rows.setdefault(game_id, row_id)
     except Error as error:
         logging.log(logging.ERROR, error)
-    finally:
-        if conn:
-            conn.close()
+        return []
+
+    # The destinations of each cover row, keyed by its rowid
+    cover_rows = {}
+    for game_id, game_destinations in destinations.items():
+        row_id = game_cover_rows.get(aliases.get(game_id, game_id)) or game_cover_rows.get(game_id)
+        if row_id is not None:
+            cover_rows.setdefault(row_id, []).extend(game_destinations)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        written = executor.map(lambda cover_row: _export_cover(*cover_row, cover_profile, cover_cache),
+                               cover_rows.items())
+        return [destination for row_destinations in written for destination in row_destinations]
+
+
+def _export_cover(row_id, destinations, cover_profile=None, cover_cache=None):
+    transcode = cover_profile is not None and not cover_profile.passthrough
+    try:
+        with _pooled_connection() as conn:
+            if transcode:
+                source = _cached_cover(conn, row_id, cover_profile, cover_cache)
+            elif _stream_cover_blob(conn, row_id, destinations[0]):
+                source = destinations[0]
+            else:
+                source = None
+    except (OSError, Error, ValueError) as error:
+        logging.log(logging.ERROR, f'Cover {row_id}: {error}')
+        return []
+    if source is None:
+        return []
+
+    written = [] if transcode else [destinations[0]]
+    for destination in destinations[len(written):]:
+        def copy_cover(output_file):
+            with open(source, 'rb') as cover_file:
+                copyfileobj(cover_file, output_file, COVER_CHUNK_SIZE)
+
+        if _write_atomically(destination, copy_cover):
+            written.append(destination)
+    return written
+
+
+# Function that returns the cover_cache file of a cover blob in the given profile, transcoding it if needed
+def _cached_cover(conn, row_id, cover_profile, cover_cache):
+    cover_data = bytearray()
+    cover_hash = hashlib.sha256()
+    with conn.blobopen('covers', 'psio', row_id, readonly=True) as blob:
+        while chunk := blob.read(COVER_CHUNK_SIZE):
+            cover_data += chunk
+            cover_hash.update(chunk)
+    return cover_cache.get(cover_data, cover_profile, cover_hash.hexdigest())
+
+
+# Function that lists the database split-files, using the manifest when it is available
+def _database_split_manifest():
+    manifest_path = join(DATABASE_PATH, DATABASE_MANIFEST_FILE)
+    if exists(manifest_path):
+        with open(manifest_path, newline='') as manifest_file:
+            return [(row['filename'], int(row['filesize'])) for row in DictReader(manifest_file)]
+    return [(f'psio_assist_{i}.db', None) for i in range(1, 5)]  # Adjust the range if you have more split files
 
 
 # Function that checks if each of the database split-files exist
 def _database_splits_exist():
-    for i in range(1, 5):  # Adjust the range if you have more split files
-        if not exists(join(DATABASE_PATH, f'psio_assist_{i}.db')):
+    for split_file, _ in _database_split_manifest():
+        if not exists(join(DATABASE_PATH, split_file)):
+            return False
+    return True
+
+
+# Function that checks each database split-file against the size recorded in the manifest
+def _verify_database_splits():
+    for split_file, split_size in _database_split_manifest():
+        split_path = join(DATABASE_PATH, split_file)
+        if not exists(split_path):
+            logging.log(logging.ERROR, f'Database split-file missing: {split_file}')
+            return False
+        if split_size is not None and getsize(split_path) != split_size:
+            logging.log(logging.ERROR,
+                        f'Database split-file {split_file} is {getsize(split_path)} bytes, expected {split_size}')
             return False
     return True
 
 
 # Function that deletes the database split-files
 def _delete_database_splits():
-    for i in range(1, 5):  # Adjust the range if you have more split files
-        if exists(join(DATABASE_PATH, f'psio_assist_{i}.db')):
-            remove(join(DATABASE_PATH, f'psio_assist_{i}.db'))
+    for split_file, _ in _database_split_manifest():
+        if exists(join(DATABASE_PATH, split_file)):
+            remove(join(DATABASE_PATH, split_file))
 
 
 # Function that merges the split database files
-def _merge_database():
-    # List of source databases
-    source_dbs = [join(DATABASE_PATH, f'psio_assist_{i}.db') for i in range(1, 5)]  # Adjust the range if needed
-
-    # Connect to the destination database
-    destination_conn = connect(DATABASE_FULL_PATH)
-    destination_cursor = destination_conn.cursor()
-
-    # Function to copy table structure and data
-    def copy_table_structure_and_data(source_cursor, destination_cursor, table_name):
-        # Get the table structure
-        source_cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = source_cursor.fetchall()
-        column_names = [col[1] for col in columns]
-
-        # Check if the table already exists in the destination database
-        destination_cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-        if not destination_cursor.fetchone():
-            # Create table in the destination database
-            source_cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            create_table_sql = source_cursor.fetchone()[0]
-            destination_cursor.execute(create_table_sql)
-
-        # Copy data
-        source_cursor.execute(f"SELECT * FROM {table_name}")
-        rows = source_cursor.fetchall()
-        placeholders = ', '.join('?' * len(column_names))
-        destination_cursor.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", rows)
-
-    # Process each source database
-    for source_db in source_dbs:
-        source_conn = connect(source_db)
-        source_cursor = source_conn.cursor()
-
-        # Get the list of tables in the source database
-        source_cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = source_cursor.fetchall()
-
-        # Copy each table
-        for table in tables:
-            table_name = table[0]
-            copy_table_structure_and_data(source_cursor, destination_cursor, table_name)
-
-        # Close the source database connection
-        source_conn.close()
-
-    # Commit changes and close the destination database connection
-    destination_conn.commit()
-    destination_conn.close()
+#
+# The split-files are consecutive byte chunks of one database (split with filesplit, see fs_manifest.csv), so they are
+# streamed back together in manifest order. The merge is built in a temp file and only renamed over psio_assist.db once
+# it is complete and optimised, so an interrupted merge leaves the split-files untouched and is simply restarted on the
+# next launch.
+def _merge_database(progress_callback=None):
+    close_connections()
+
+    if not _verify_database_splits():
+        return False
+
+    split_paths = [join(DATABASE_PATH, split_file) for split_file, _ in _database_split_manifest()]
+    temp_database_path = f'{DATABASE_FULL_PATH}.tmp'
+    try:
+        with open(temp_database_path, 'wb') as database_file:
+            for count, split_path in enumerate(split_paths):
+                with open(split_path, 'rb') as split_file:
+                    copyfileobj(split_file, database_file, DATABASE_MERGE_CHUNK_SIZE)
+
+                logging.log(logging.INFO, f'Merging database: {count + 1}/{len(split_paths)} ({basename(split_path)})')
+                if progress_callback:
+                    progress_callback(count + 1, len(split_paths))
+
+        with open(temp_database_path, 'rb') as database_file:
+            if database_file.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+                raise OSError(f'The merged split-files are not an SQLite database: {temp_database_path}')
+    except OSError as error:
+        logging.log(logging.ERROR, error)
+        if exists(temp_database_path):
+            remove(temp_database_path)
+        return False
+
+    if not _optimise_database(temp_database_path):
+        remove(temp_database_path)
+        return False
+    replace(temp_database_path, DATABASE_FULL_PATH)
 
     _delete_database_splits()
+    return True
+
+
+# Function that reads the layout version stored in the merged database
+def _database_layout_version():
+    try:
+        conn = connect(DATABASE_FULL_PATH)
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+    except Error as error:
+        logging.log(logging.ERROR, error)
+    return DATABASE_LAYOUT_VERSION
+
+
+# Function that indexes the merged database for the lookup pattern GameHandler uses, then compacts it
+# Returns False when the database could not be optimised (e.g. it is corrupt)
+def _optimise_database(database_path=None):
+    close_connections()
+
+    try:
+        conn = connect(database_path or DATABASE_FULL_PATH)
+        try:
+            with conn:
+                for index_name, table_name, columns in DATABASE_INDEXES:
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})')
+
+                # Cover blobs are fetched by id, which needs its own index unless it is already the rowid
+                if not _is_rowid_alias(conn, 'covers', 'id'):
+                    conn.execute('CREATE INDEX IF NOT EXISTS covers_id_index ON covers (id)')
+
+                conn.execute('ANALYZE')
+                conn.execute(f'PRAGMA user_version = {DATABASE_LAYOUT_VERSION}')
+
+            # VACUUM rewrites every table contiguously, so the metadata pages end up together ahead of the blobs
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+    except Error as error:
+        logging.log(logging.ERROR, error)
+        return False
+    return True
+
+
+# Function that checks whether a column is an INTEGER PRIMARY KEY (an alias of the rowid)
+def _is_rowid_alias(conn, table_name, column_name):
+    primary_keys = [(name, column_type) for _, name, column_type, _, _, pk in
+                    conn.execute(f'PRAGMA table_info({table_name})') if pk]
+    return len(primary_keys) == 1 and primary_keys[0][0] == column_name and primary_keys[0][1].upper() == 'INTEGER'
@@ -1,26 +1,27 @@
-class Game:
-    def __init__(self, directory_name, directory_path, game_id, disc_number, disc_collection, cue_sheet,
-                 cover_art_present, cu2_present):
-        self.directory_name = directory_name
-        self.directory_path = directory_path
-        self.id = game_id
-        self.disc_number = disc_number
-        self.disc_collection = disc_collection
-        self.cue_sheet = cue_sheet
-        self.cover_art_present = cover_art_present
-        self.cu2_present = cu2_present
+from dataclasses import dataclass, field
 
-    def set_new_directory_name(self, new_name):
-        self.directory_name = new_name
+
+# The records are slotted so a library of thousands of discs does not carry a dict per object. eq=False keeps the
+# identity comparison and hashing of plain classes, games are looked up by identity throughout GameHandler.
+@dataclass(slots=True, eq=False)
+class Binfile:
+    file_name: str
+    file_path: str
+    new_name: str | None = None
+
+    def set_new_name(self, new_name):
+        self.new_name = new_name
 
 
+@dataclass(slots=True, eq=False)
 class Cuesheet:
-    def __init__(self, file_name, file_path, game_name):
-        self.file_name = file_name
-        self.file_path = file_path
-        self.game_name = game_name
-        self.new_name = None
-        self.bin_files = []
+    file_name: str
+    file_path: str
+    game_name: str
+    # Parsed cue_parser.Cue model, shared by the merge, CU2 and rename steps
+    cue: object = None
+    new_name: str | None = None
+    bin_files: list = field(default_factory=list)
 
     def add_bin_file(self, bin_file):
         self.bin_files.append(bin_file)
@@ -29,11 +30,32 @@ class Cuesheet:
         self.new_name = new_name
 
 
-class Binfile:
-    def __init__(self, file_name, file_path):
-        self.file_name = file_name
-        self.file_path = file_path
-        self.new_name = None
+@dataclass(slots=True, eq=False)
+class Game:
+    directory_name: str
+    directory_path: str
+    id: str | None
+    disc_number: int | None
+    disc_collection: list[str] | None
+    cue_sheet: Cuesheet
+    cover_art_present: bool
+    cu2_present: bool
+    # Classification flags, set once per scan by GameHandler._classify_game
+    unidentified: bool = False
+    no_cover: bool = False
+    is_multi_disc: bool = False
+    multi_disc: bool = False
+    multi_bin: bool = False
+    invalid_name: bool = False
 
-    def set_new_name(self, new_name):
-        self.new_name = new_name
+    def set_new_directory_name(self, new_name):
+        self.directory_name = new_name
+
+
+@dataclass(slots=True, eq=False)
+class Cu2Result:
+    game: Game
+    success: bool
+    cu2_path: str | None = None
+    error: str | None = None
+    warnings: list = field(default_factory=list)
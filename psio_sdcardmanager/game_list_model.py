@@ -0,0 +1,157 @@
+"""
+Table model that presents the scanned Game list directly to the game list view
+"""
+import logging
+
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+logger = logging.getLogger(__name__)
+
+BOOLS = ('No', 'Yes')
+
+
+# Rows are the Game objects themselves, the cell text is only worked out when the view asks for a visible cell.
+# Sorting and filtering happen here, so games streamed in by a scan are inserted straight into their sorted place.
+class GameListModel(QAbstractTableModel):
+    HEADERS = ['ID', 'Name', 'Disc Number', 'Bin Files', 'Name Valid', 'CU2', 'BMP']
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Every game, and the games that pass the filter in display order
+        self._games = []
+        self._rows = []
+        self._filter_text = ''
+        self._sort_column = None
+        self._sort_order = Qt.SortOrder.AscendingOrder
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        game = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self._display_value(game, index.column())
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return game.cue_sheet.file_path
+        if role == Qt.ItemDataRole.UserRole:
+            return game
+        return None
+
+    def game(self, row):
+        return self._rows[row]
+
+    # Function that replaces the whole game list (e.g. once a scan has finished)
+    def set_games(self, game_list):
+        self.beginResetModel()
+        self._games = list(game_list)
+        self._rows = self._sorted([game for game in self._games if self._matches(game)])
+        self.endResetModel()
+
+    # Function that adds newly scanned games, each one is inserted at its sorted position
+    def append_games(self, game_list):
+        self._games += game_list
+        games = [game for game in game_list if self._matches(game)]
+
+        if self._sort_column is None:
+            if games:
+                self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(games) - 1)
+                self._rows += games
+                self.endInsertRows()
+            return
+
+        for game in games:
+            row = self._insert_position(game)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._rows.insert(row, game)
+            self.endInsertRows()
+
+    # Function to refresh the row of a game whose files have changed (e.g. after it has been processed)
+    def game_updated(self, game):
+        for row, row_game in enumerate(self._rows):
+            if row_game is game:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+                return
+
+    def set_filter(self, text):
+        self._filter_text = text.strip().lower()
+        self.beginResetModel()
+        self._rows = self._sorted([game for game in self._games if self._matches(game)])
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+
+        self.layoutAboutToBeChanged.emit()
+        persistent_indexes = self.persistentIndexList()
+        persistent_games = [(self._rows[index.row()], index.column()) for index in persistent_indexes]
+
+        self._rows = self._sorted(self._rows)
+
+        rows = {id(game): row for row, game in enumerate(self._rows)}
+        self.changePersistentIndexList(persistent_indexes,
+                                       [self.index(rows[id(game)], column) for game, column in persistent_games])
+        self.layoutChanged.emit()
+
+    def _display_value(self, game, column):
+        if column == 0:
+            return str(game.id)
+        if column == 1:
+            return game.cue_sheet.game_name
+        if column == 2:
+            return str(game.disc_number)
+        if column == 3:
+            return str(len(game.cue_sheet.bin_files))
+        if column == 4:
+            return BOOLS[not game.invalid_name]
+        if column == 5:
+            return BOOLS[bool(game.cu2_present)]
+        if column == 6:
+            return BOOLS[bool(game.cover_art_present)]
+        return None
+
+    def _sort_key(self, game):
+        column = self._sort_column
+        if column == 2:
+            value = int(game.disc_number or 0)
+        elif column == 3:
+            value = len(game.cue_sheet.bin_files)
+        else:
+            value = self._display_value(game, column)
+        # Ties keep the scan order (name, then path)
+        return value, game.cue_sheet.game_name, game.cue_sheet.file_path
+
+    def _sorted(self, games):
+        if self._sort_column is None:
+            return games
+        return sorted(games, key=self._sort_key, reverse=self._sort_order == Qt.SortOrder.DescendingOrder)
+
+    # Binary search for the row a game belongs in with the current sort
+    def _insert_position(self, game):
+        key = self._sort_key(game)
+        ascending = self._sort_order == Qt.SortOrder.AscendingOrder
+        low, high = 0, len(self._rows)
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._sort_key(self._rows[middle])
+            if (key < middle_key) if ascending else (middle_key < key):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _matches(self, game):
+        if not self._filter_text:
+            return True
+        return self._filter_text in game.cue_sheet.game_name.lower() or self._filter_text in str(game.id).lower()
@@ -1,120 +1,318 @@
-import concurrent
+import concurrent.futures
 import logging
+import re
 import sqlite3
-from os import listdir, scandir, mkdir, remove, rename
+from io import BufferedReader
+from os import listdir, scandir, remove, rename, replace
 from os.path import exists, join, basename, splitext
-from shutil import move, rmtree
-
-from PyQt6.QtCore import QObject
-from PyQt6.QtWidgets import QMessageBox
-from pathlib2 import Path
-
-from psio_sdcardmanager.binmerge import start_bin_merge, read_cue_file
-from psio_sdcardmanager.cue2cu2 import start_cue2cu2
-from psio_sdcardmanager.db import select, extract_game_cover_blob
-from psio_sdcardmanager.game_files import Cuesheet, Binfile, Game
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+
+from psio_sdcardmanager.binmerge import start_bin_merge, resume_in_place_merges, VirtualDisc, IN_PLACE_JOURNAL_SUFFIX
+from psio_sdcardmanager.covers import COVER_PROFILES, DEFAULT_COVER_PROFILE, CoverCache
+from psio_sdcardmanager.cue2cu2 import start_cue2cu2, cue2cu2_bytes, write_cu2, Cu2Error
+from psio_sdcardmanager.cue_parser import parse_cue, ZeroBinFilesException, BinFilesMissingException
+from psio_sdcardmanager.db import select, select_game_metadata, export_game_covers
+from psio_sdcardmanager.game_files import Cuesheet, Binfile, Game, Cu2Result
+from psio_sdcardmanager.multidisc import (load_disc_aliases, build_disc_index, group_disc_sets, write_multidisc_file,
+                                          MULTI_DISC_FILE)
+from psio_sdcardmanager.scan_cache import ScanCache
 from psio_sdcardmanager.serial_finder import get_serial
 
+# How much of the start of an image is searched for the serials of the other discs in its set
+DISC_COLLECTION_SCAN_BYTES = 512 * 1024
+
 logger = logging.getLogger(__name__)
 
 
-class GameHandler(QObject):
+class GameHandler:
     def __init__(self):
-        super().__init__()
         self.MAX_GAME_NAME_LENGTH = 56
+        # Bounded so a slow SD card reader is not flooded with concurrent reads
+        self.MAX_SCAN_WORKERS = 8
+        self.MAX_CU2_WORKERS = 8
+        # process_games stages: merges are limited by the SD card's write bandwidth, so only a couple run at once
+        self.MAX_MERGE_WORKERS = 2
+        self.MAX_PROCESS_WORKERS = 4
+        # One lock per game directory, the discs of a set are renamed by different workers but share a directory
+        self._rename_locks = {}
         self.REGION_CODES = ['DTLS_', 'SCES_', 'SLES_', 'SLED_', 'SCED_', 'SCUS_', 'SLUS_', 'SLPS_', 'SCAJ_', 'SLKA_',
                              'SLPM_', 'SCPS_', 'SCPM_', 'PCPX_', 'PAPX_', 'PTPX_', 'LSP0_', 'LSP1_', 'LSP2_', 'LSP9_',
                              'SIPS_', 'ESPM_', 'SCZS_', 'SPUS_', 'PBPX_', 'LSP_']
+        self._region_code_regex = re.compile('|'.join(re.escape(region_code) for region_code in self.REGION_CODES))
+
+    # progress_callback(done, total, game) is called as each game leaves the pipeline and status_callback(stage, game)
+    # as a game enters a stage, both from the worker threads. Once cancel_event is set no further stage is started.
+    # cover_profile is a key of COVER_PROFILES, the device the cover art is written for.
+    def process_games(self, merge_bin_files, force_cu2, auto_rename, validate_game_name, add_cover_art, game_list,
+                      merge_in_place=False, progress_callback=None, status_callback=None, cancel_event=None,
+                      create_multi_disc=False, cover_profile=DEFAULT_COVER_PROFILE):
+        # Resolve the database metadata of the whole library up front instead of querying per game
+        game_metadata = select_game_metadata([self._db_game_id(game.id) for game in game_list if game.id])
+
+        def metadata_for(game):
+            if not game.id:
+                return None
+            return game_metadata.get(self._db_game_id(game.id), {'name': None, 'disc_number': 0, 'cover_id': None})
+
+        # The covers are written together once every game has been renamed
+        cover_requests = []
+
+        # Each game passes through the stages in order (CU2 only once its bin files are merged, the rename and cover
+        # only once its CU2 sheet exists), while different games are in different stages at the same time
+        self._run_pipeline(game_list, [
+            ('Merging bin files', self.MAX_MERGE_WORKERS,
+             lambda game: self._process_game_merge(game, merge_bin_files, merge_in_place)),
+            ('Generating cu2 file', self.MAX_CU2_WORKERS,
+             lambda game: self._process_game_cu2(game, force_cu2)),
+            ('Renaming and adding cover art', self.MAX_PROCESS_WORKERS,
+             lambda game: self._process_game_files(game, auto_rename, validate_game_name, add_cover_art,
+                                                   metadata_for(game), cover_requests)),
+        ], progress_callback, status_callback, cancel_event)
+
+        if cover_requests:
+            logging.log(logging.INFO, f'ADDING THE GAME COVER ART... ({len(cover_requests)} games)')
+            export_game_covers(cover_requests, cover_profile=COVER_PROFILES[cover_profile], cover_cache=CoverCache(),
+                               aliases=load_disc_aliases())
+
+        if create_multi_disc and not (cancel_event is not None and cancel_event.is_set()):
+            self.generate_multidisc_files(game_list)
 
-    def process_games(self, merge_bin_files, force_cu2, auto_rename, validate_game_name, add_cover_art, game_list):
-        for game in game_list:
+    # *****************************************************************************************************************
+
+    # *****************************************************************************************************************
+    # Function that runs every game through a list of (name, workers, function) stages, each stage with its own
+    # thread pool. A game is handed to the next stage as soon as its previous stage finishes, a game that fails is
+    # logged and dropped from the remaining stages without holding up the others.
+    def _run_pipeline(self, game_list, stages, progress_callback=None, status_callback=None, cancel_event=None):
+        executors = [concurrent.futures.ThreadPoolExecutor(max_workers=workers) for _, workers, _ in stages]
+
+        def submit(game, stage):
+            name, _, function = stages[stage]
+
+            def run_stage():
+                if status_callback:
+                    status_callback(name, game)
+                function(game)
+
+            pending[executors[stage].submit(run_stage)] = (game, stage)
 
-            game_id = game.id
-            game_name = game.cue_sheet.game_name
+        finished = 0
+        try:
+            pending = {}
+            for game in game_list:
+                submit(game, 0)
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                if cancelled:
+                    # Stages that are already running are left to finish, so no game is left half merged
+                    for future in pending:
+                        future.cancel()
+                for future in done:
+                    game, stage = pending.pop(future)
+                    try:
+                        future.result()
+                    except Exception as error:
+                        logging.log(logging.ERROR, f'Processing {game.cue_sheet.game_name} failed: {error}')
+                        stage = len(stages) - 1
+                    if stage + 1 < len(stages) and not cancelled:
+                        submit(game, stage + 1)
+                    else:
+                        finished += 1
+                        if progress_callback:
+                            progress_callback(finished, len(game_list), game)
+                if cancelled:
+                    pending = {future: entry for future, entry in pending.items() if not future.cancelled()}
+        finally:
+            for executor in executors:
+                executor.shutdown()
+
+    # *****************************************************************************************************************
 
-            game_full_path = join(game.directory_path, game.directory_name)
-            cue_full_path = game.cue_sheet.file_path
+    # *****************************************************************************************************************
+    # Function for the merge stage of process_games (bound by the write speed of the SD card)
+    def _process_game_merge(self, game, merge_bin_files, merge_in_place):
+        game_name = game.cue_sheet.game_name
+        game_full_path = join(game.directory_path, game.directory_name)
+        cue_full_path = game.cue_sheet.file_path
 
-            #  #  label_progress.configure(text=f'{PROGRESS_STATUS} Processing - {game_name}')
+        #  #  label_progress.configure(text=f'{PROGRESS_STATUS} Processing - {game_name}')
 
-            logging.log(logging.INFO, f'GAME_ID: {game_id}')
-            logging.log(logging.INFO, f'GAME_NAME: {game_name}')
-            logging.log(logging.INFO, f'GAME_PATH: {game_full_path}')
-            logging.log(logging.INFO, f'CUE_PATH: {cue_full_path}')
+        logging.log(logging.INFO, f'GAME_ID: {game.id}')
+        logging.log(logging.INFO, f'GAME_NAME: {game_name}')
+        logging.log(logging.INFO, f'GAME_PATH: {game_full_path}')
+        logging.log(logging.INFO, f'CUE_PATH: {cue_full_path}')
 
-            if merge_bin_files and len(game.cue_sheet.bin_files) > 1:
-                logging.log(logging.INFO, 'MERGING BIN FILES...')
-                #     #  label_progress.configure(text=f'{PROGRESS_STATUS} Merging bin files - {game_name}')
-                self._merge_bin_files(game, game_name, game_full_path, cue_full_path)
+        if merge_bin_files and len(game.cue_sheet.bin_files) > 1:
+            logging.log(logging.INFO, f'MERGING BIN FILES... ({game_name})')
+            #     #  label_progress.configure(text=f'{PROGRESS_STATUS} Merging bin files - {game_name}')
+            self._merge_bin_files(game, game_name, game_full_path, cue_full_path, merge_in_place)
 
-            if force_cu2 and not game.cu2_present:
-                logging.log(logging.INFO, 'GENERATING CU2...')
-                #    #  label_progress.configure(text=f'{PROGRESS_STATUS} Generating cu2 file - {game_name}')
-                start_cue2cu2(cue_full_path, f'{game_name}.bin')
+    # *****************************************************************************************************************
 
-            if auto_rename:
-                logging.log(logging.INFO, 'RENAMING THE GAME FILES...')
-                #    #  label_progress.configure(text=f'{PROGRESS_STATUS} Renaming - {game_name}')
-                redump_game_name = self._game_name_validator(game,self.get_redump_name(game_id))
-                self._rename_game(game_full_path, game_name, redump_game_name)
+    # *****************************************************************************************************************
+    # Function for the CU2 stage of process_games
+    def _process_game_cu2(self, game, force_cu2):
+        game_name = game.cue_sheet.game_name
+        if force_cu2 and not game.cu2_present:
+            logging.log(logging.INFO, f'GENERATING CU2... ({game_name})')
+            #    #  label_progress.configure(text=f'{PROGRESS_STATUS} Generating cu2 file - {game_name}')
+            cue = self._get_cue(game)
+            if start_cue2cu2(cue.path, f'{game_name}.bin', cue=cue):
+                game.cu2_present = True
 
-            if validate_game_name and not auto_rename:
-                if len(game_name) > self.MAX_GAME_NAME_LENGTH or '.' in game_name:
-                    logging.log(logging.INFO, 'VALIDATING THE GAME NAME...')
-                    #      #  label_progress.configure(text=f'{PROGRESS_STATUS} Validating name - {game_name}')
-                    #TODO need to fix bug with renaming schema
-                    new_game_name = self._game_name_validator(game)
-                    logging.log(logging.INFO, f'new_game_name: {new_game_name}')
-                    if new_game_name != game_name:
-                        self._rename_game(game_full_path, game_name, new_game_name)
+    # *****************************************************************************************************************
 
-            if add_cover_art:
-                logging.log(logging.INFO, 'ADDING THE GAME COVER ART...')
-                self._copy_game_cover(game_full_path, game_id, game_name)
+    # *****************************************************************************************************************
+    # Function for the last stage of process_games: renaming, name validation and queueing the cover art
+    def _process_game_files(self, game, auto_rename, validate_game_name, add_cover_art, metadata, cover_requests):
+        game_id = game.id
+        game_name = game.cue_sheet.game_name
+        game_full_path = join(game.directory_path, game.directory_name)
+
+        if auto_rename and game_id:
+            logging.log(logging.INFO, f'RENAMING THE GAME FILES... ({game_name})')
+            #    #  label_progress.configure(text=f'{PROGRESS_STATUS} Renaming - {game_name}')
+            redump_game_name = self.get_redump_name(game_id, validate_game_name, metadata=metadata)
+            if redump_game_name:
+                redump_game_name = self._game_name_validator(game, redump_game_name)
+                self._rename_game_files(game, game_full_path, game_name, redump_game_name)
+
+        if validate_game_name and not auto_rename:
+            if len(game_name) > self.MAX_GAME_NAME_LENGTH or '.' in game_name:
+                logging.log(logging.INFO, f'VALIDATING THE GAME NAME... ({game_name})')
+                #      #  label_progress.configure(text=f'{PROGRESS_STATUS} Validating name - {game_name}')
+                new_game_name = self._game_name_validator(game, game_name)
+                logging.log(logging.INFO, f'new_game_name: {new_game_name}')
+                self._rename_game_files(game, game_full_path, game_name, new_game_name)
+
+        if add_cover_art:
+            # The cover is named after the renamed files
+            cover_request = self._get_cover_request(game_full_path, game_id, game.cue_sheet.new_name or game_name,
+                                                    metadata)
+            if cover_request:
+                cover_requests.append(cover_request)
+
+    # Function that renames a game unless another game in its directory already has the new name
+    # The check and the rename are made under the directory's lock, so two discs renamed to the same (truncated) name
+    # at the same time cannot both pass the check and overwrite each other's files
+    def _rename_game_files(self, game, game_full_path, game_name, new_game_name):
+        if new_game_name == game_name:
+            return
+        with self._rename_locks.setdefault(game_full_path, Lock()):
+            if any(exists(join(game_full_path, f'{new_game_name}{extension}'))
+                   for extension in ('.bin', '.cue', '.cu2')):
+                logging.log(logging.ERROR,
+                            f'Not renaming {game_name}, {new_game_name} already exists in {game_full_path}')
+                game.cue_sheet.new_name = None
+                return
+            self._rename_game(game_full_path, game_name, new_game_name, self._get_cue(game))
+
+    # *****************************************************************************************************************
+
+    # *****************************************************************************************************************
+    # Function to generate a CU2 sheet for every game that is missing one, returning a Cu2Result per game
+    # With dry_run set nothing is written, the results only report which games would fail and why
+    def generate_cu2_sheets(self, game_list, dry_run=False):
+        games = [game for game in game_list if not game.cu2_present]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.MAX_CU2_WORKERS) as executor:
+            results = list(executor.map(lambda game: self._generate_cu2_sheet(game, dry_run), games))
+
+        failed = [result for result in results if not result.success]
+        logging.log(logging.INFO, f'CU2 sheets: {len(results) - len(failed)} ok, {len(failed)} failed'
+                                  f'{" (dry run)" if dry_run else ""}')
+        for result in failed:
+            logging.log(logging.INFO, f'{result.game.cue_sheet.game_name}: {result.error}')
+
+        return results
+
+    def _generate_cu2_sheet(self, game, dry_run):
+        game_name = game.cue_sheet.game_name
+        warnings = []
+        try:
+            cue = self._get_cue(game)
+            if len(cue.files) > 1:
+                return Cu2Result(game, False, error=f'{len(cue.files)} bin files, they need to be merged first')
+            output = cue2cu2_bytes(cue.path, f'{game_name}.bin', cue=cue, warnings=warnings)
+        except (Cu2Error, OSError, ZeroBinFilesException, BinFilesMissingException) as error:
+            return Cu2Result(game, False, error=str(error) or type(error).__name__, warnings=warnings)
+
+        if dry_run:
+            return Cu2Result(game, True, warnings=warnings)
+
+        cu2_path = write_cu2(cue.path, f'{game_name}.bin', output)
+        if cu2_path is None:
+            return Cu2Result(game, False, error=f'Could not write the CU2 sheet for {game_name}', warnings=warnings)
+
+        game.cu2_present = True
+        return Cu2Result(game, True, cu2_path, warnings=warnings)
 
     # *****************************************************************************************************************
 
     # *****************************************************************************************************************
     # Function to merge multi-bin files
-    def _merge_bin_files(self, game, game_name, game_full_path, cue_full_path):
-        # Create a temp directory to store the merged bin file
-        temp_game_dir = join(game_full_path, 'temp_dir')
-        if not exists(temp_game_dir):
-            try:
-                mkdir(temp_game_dir)
-            except OSError as error:
-                logging.log(logging.ERROR, error)
-        if exists(temp_game_dir):
+    def _merge_bin_files(self, game, game_name, game_full_path, cue_full_path, in_place=False):
+        cue = self._get_cue(game)
+        merged_bin_path = join(game_full_path, f'{game_name}.bin')
+        merged_cue_path = join(game_full_path, f'{game_name}.cue')
+
+        if in_place:
+            # Append the tracks to the first track file, this only needs free space for one track
+            if start_bin_merge(cue_full_path, game_name, game_full_path, in_place=True, cue=cue):
+                game.cue_sheet.cue = cue.merged(merged_bin_path, merged_cue_path)
+            return
+
+        # Create a temp directory to store the merged bin file (inside the game directory, so it is on the same
+        # filesystem and moving the results back is a rename rather than a copy). Every merge gets its own, the discs
+        # of a set in the same directory can be merged at the same time.
+        try:
+            temp_game_dir = mkdtemp(prefix='temp_dir_', dir=game_full_path)
+        except OSError as error:
+            logging.log(logging.ERROR, error)
+            return
+
+        try:
             #  #  label_progress.configure(text=f'{PROGRESS_STATUS} Merging bin files')
-            start_bin_merge(cue_full_path, game_name, temp_game_dir)
+            start_bin_merge(cue_full_path, game_name, temp_game_dir, cue=cue)
 
             # If the bin files have been merged and the new cue file has been generated
             temp_bin_path = join(temp_game_dir, f'{game_name}.bin')
             temp_cue_path = join(temp_game_dir, f'{game_name}.cue')
             if exists(temp_bin_path) and exists(temp_cue_path):
-                # Delete the original cue_sheet and bin files
-                remove(cue_full_path)
-                for orginal_bin_file in game.cue_sheet.bin_files:
-                    remove(orginal_bin_file.file_path)
+                # Move the newly merged bin_file and cue_sheet into the game directory before anything is deleted
+                replace(temp_bin_path, merged_bin_path)
+                replace(temp_cue_path, merged_cue_path)
 
-                # Move the newly merged bin_file and cue_sheet back into the game directory
-                move(temp_bin_path, join(game_full_path, f'{game_name}.bin'))
-                move(temp_cue_path, join(game_full_path, f'{game_name}.cue'))
+                # Delete the original cue_sheet and bin files (unless the merged files have replaced them)
+                if cue_full_path != merged_cue_path and exists(cue_full_path):
+                    remove(cue_full_path)
+                for orginal_bin_file in game.cue_sheet.bin_files:
+                    if orginal_bin_file.file_path != merged_bin_path and exists(orginal_bin_file.file_path):
+                        remove(orginal_bin_file.file_path)
 
-            rmtree(temp_game_dir)
+                # The later steps work on the merged layout without re-reading the new cue sheet
+                game.cue_sheet.cue = cue.merged(merged_bin_path, merged_cue_path)
+        finally:
+            rmtree(temp_game_dir, ignore_errors=True)
 
     # *****************************************************************************************************************
 
     # *****************************************************************************************************************
     # Function to rename a game and all associated files
-    def _rename_game(self, game_full_path, game_name, new_game_name):
+    def _rename_game(self, game_full_path, game_name, new_game_name, cue=None):
         original_bin_file = join(game_full_path, f'{game_name}.bin')
         original_cue_file = join(game_full_path, f'{game_name}.cue')
         original_cu2_file = join(game_full_path, f'{game_name}.cu2')
 
-        # Rename bin file
-        if exists(original_bin_file):
-            rename(original_bin_file, join(game_full_path, f'{new_game_name}.bin'))
+        # Rename the bin files listed in the cue sheet (every track of a multi-bin game), or the single bin file
+        bin_files = [cue_file.filename for cue_file in cue.files] if cue else [original_bin_file]
+        for bin_file in bin_files:
+            if exists(bin_file) and basename(bin_file).startswith(game_name):
+                rename(bin_file, join(game_full_path, new_game_name + basename(bin_file)[len(game_name):]))
 
         # Rename cue file and edit the cue file contents to match
         if exists(original_cue_file):
@@ -150,6 +348,13 @@ class GameHandler(QObject):
         game.cue_sheet.new_name = game_name
         return game_name
 
+    # *****************************************************************************************************************
+    # Function to get the parsed cue sheet of a game (games restored from the scan cache are parsed on first use)
+    def _get_cue(self, game):
+        if game.cue_sheet.cue is None:
+            game.cue_sheet.cue = parse_cue(game.cue_sheet.file_path)
+        return game.cue_sheet.cue
+
     # *****************************************************************************************************************
     # Function to check if the game is a multi-bin game
     def _is_multi_bin(self, game):
@@ -168,50 +373,74 @@ class GameHandler(QObject):
     # *****************************************************************************************************************
 
     # *****************************************************************************************************************
-    # Function that generates a MULTIDISC.LST file for multi-disc games
-    def _generate_multidisc_file(self, game_dir, output_path=None):
-        bin_files = [f for f in listdir(join(output_path, game_dir)) if f.endswith('.bin')]
-
-        # If there is more than 1 bin file, this should be a multi-disc game
-        multi_disc_bins = []
-        if len(bin_files) > 1:
-            for bin_file in bin_files:
-                disc_number = self._get_disc_number(self.get_game_id(join(output_path, game_dir, bin_file)))
-                if disc_number > 0:
-                    multi_disc_bins.insert(disc_number - 1, bin_file)
-
-        # Create the MULTIDISC.LST file
-        if len(multi_disc_bins) > 0:
-            with open(join(output_path, game_dir, 'MULTIDISC.LST'), 'w') as multi_disc_file:
-                for count, binfile in enumerate(multi_disc_bins):
-                    if count < len(multi_disc_bins) - 1:
-                        # multi_disc_file.write(f'{binfile}\n')
-                        multi_disc_file.write(f'{binfile}\r')
-                    else:
-                        multi_disc_file.write(binfile)
+    # Function that generates a MULTIDISC.LST file for each multi-disc set in the game list, returning the sets
+    # The discs are grouped by the in-memory multi-disc index (serial, database and alias map), without bin file I/O
+    def generate_multidisc_files(self, game_list):
+        aliases = load_disc_aliases()
+        serials = [self._db_game_id(game.id) for game in game_list if game.id]
+        metadata = select_game_metadata(serials + [aliases[serial] for serial in serials if serial in aliases])
+        disc_index = build_disc_index([(self._db_game_id(game.id), game.cue_sheet.game_name)
+                                       for game in game_list if game.id], metadata, aliases)
+
+        disc_sets = group_disc_sets([game for game in game_list if game.id], disc_index,
+                                    lambda game: (join(game.directory_path, game.directory_name),
+                                                  self._db_game_id(game.id)))
+        for disc_set in disc_sets:
+            game_full_path = join(disc_set[0].directory_path, disc_set[0].directory_name)
+            bin_names = [self._current_bin_name(game) for game in disc_set]
+            if None in bin_names:
+                logging.log(logging.ERROR, f'Not creating {MULTI_DISC_FILE} in {game_full_path}, '
+                                           f'every disc needs to be a single bin file (merge them first)')
+                continue
+            logging.log(logging.INFO, f'Creating {MULTI_DISC_FILE} in {game_full_path}')
+            write_multidisc_file(game_full_path, bin_names)
+
+        return disc_sets
+
+    # Function that works out the current bin file name of a single-bin game from the state kept by processing
+    # (the merged cue model and the new name), so nothing has to be read back from the card
+    def _current_bin_name(self, game):
+        cue = game.cue_sheet.cue
+        bin_files = [cue_file.filename for cue_file in cue.files] if cue else \
+            [bin_file.file_path for bin_file in game.cue_sheet.bin_files]
+        if len(bin_files) != 1:
+            return None
+
+        bin_name = basename(bin_files[0])
+        game_name = game.cue_sheet.game_name
+        if game.cue_sheet.new_name and bin_name.startswith(game_name):
+            bin_name = game.cue_sheet.new_name + bin_name[len(game_name):]
+        return bin_name
 
     # *****************************************************************************************************************
 
     # *****************************************************************************************************************
     # Function to get the game name (using names from redump and the psx data-centre)
-    def get_redump_name(self, game_id, validate_game_name=None):
-        # Ensure validate_game_name has a get() method
-        if validate_game_name is None or not callable(validate_game_name.get):
+    def get_redump_name(self, game_id, validate_game_name=None, metadata=None):
+        if not game_id:
             return ''
 
+        # validate_game_name is either a bool or a setting with a get() method (e.g. a GUI checkbox variable)
+        if callable(getattr(validate_game_name, 'get', None)):
+            validate_game_name = validate_game_name.get()
+
         # Replace '-' with '_' in game_id to match the query format
         game_id = game_id.replace('-', '_')
 
-        # Execute parameterized query to avoid SQL injection
-        try:
-            response = select('SELECT name FROM games WHERE game_id = ?', (game_id,))
-        except sqlite3.Error as e:
-            logging.log(logging.ERROR,f"Database error: {e}")
+        # Use the batched lookup result if there is one, otherwise execute a parameterized query
+        response = []
+        if metadata is not None:
+            response = [(metadata['name'],)] if metadata['name'] else []
+        else:
+            try:
+                response = select('SELECT name FROM games WHERE game_id = ?', (game_id,))
+            except sqlite3.Error as e:
+                logging.log(logging.ERROR,f"Database error: {e}")
 
         if response:
             game_name = response[0][0]
 
-            if validate_game_name.get():
+            if validate_game_name:
                 disc_number = 0  # Default disc number if not found in the line
                 # Ensure disc number is extracted from the appropriate source (example usage)
                 # Example: disc_number = int(line[2])  # Replace with actual source for disc_number
@@ -234,10 +463,11 @@ class GameHandler(QObject):
 
     # *****************************************************************************************************************
     # Function to get the game name from the cue sheet (using the binmerge script)
-    def _get_game_name_from_cue(self, cue_path, include_track):
-        cue_content = read_cue_file(cue_path)
-        if cue_content:
-            game_name = basename(cue_content[0].filename)
+    def _get_game_name_from_cue(self, cue, include_track):
+        if not hasattr(cue, 'files'):
+            cue = parse_cue(cue)
+        if cue.files:
+            game_name = basename(cue.files[0].filename)
             if not include_track:
                 if 'Track' in game_name:
                     game_name = game_name[:game_name.rfind('(', 0) - 1]
@@ -258,95 +488,133 @@ class GameHandler(QObject):
     # *****************************************************************************************************************
     # Function to get the unique game id from the bin file
     def _get_disc_collection(self, bin_file_path):
-        game_disc_collection = []
-        lines_checked = 0
+        # Already open images (e.g. a VirtualDisc over a multi-bin game) are read from the start
+        if hasattr(bin_file_path, 'readline'):
+            bin_file_path.seek(0)
+            return self._read_disc_collection(bin_file_path)
 
         if exists(bin_file_path):
             with open(bin_file_path, 'rb') as bin_file:
-                while lines_checked < 300:
-                    line = bin_file.readline()
-                    if not line:
-                        break
-                    try:
-                        line = line.decode('utf-8', errors='ignore').strip()
-                    except UnicodeDecodeError:
-                        continue  # Skip lines that can't be decoded
+                return self._read_disc_collection(bin_file)
 
-                    lines_checked += 1
+        return []
 
-                    for region_code in self.REGION_CODES:
-                        if region_code in line:
-                            start = line.find(region_code)
-                            game_id = line[start:start + 11].replace('.', '').strip()
-                            if game_id not in game_disc_collection:
-                                game_disc_collection.append(game_id)
-                            else:
-                                return game_disc_collection  # Stop searching once a duplicate is found
+    def _read_disc_collection(self, bin_file):
+        game_disc_collection = []
+
+        # Binary data has no real lines, so a fixed window at the start of the image is searched instead
+        data = bin_file.read(DISC_COLLECTION_SCAN_BYTES).decode('latin-1')
+        for match in self._region_code_regex.finditer(data):
+            game_id = data[match.start():match.start() + 11].replace('.', '').strip()
+            if game_id not in game_disc_collection:
+                game_disc_collection.append(game_id)
+            else:
+                return game_disc_collection  # Stop searching once a duplicate is found
 
         return game_disc_collection
 
     # *****************************************************************************************************************
 
     # *****************************************************************************************************************
-    # Function that gets the disc number (using data from redump)
-    def _get_disc_number(self, game_id):
-        response = select(f'''SELECT disc_number FROM games WHERE game_id = "{game_id.replace('-', '_')}";''')
-        if response is not None and response != []:
-            return response[0][0]
-        return 0
+    # Function that returns the (game_id, destination) pair export_game_covers needs, if a front cover is available
+    def _get_cover_request(self, output_path, game_id, game_name, metadata=None):
+        if not game_id or (metadata is not None and metadata['cover_id'] is None):
+            return None
+        return self._db_game_id(game_id), join(output_path, f'{game_name}.bmp')
+
+    # *****************************************************************************************************************
 
     # *****************************************************************************************************************
+    # Function to convert a scanned game id (SLUS-00705) to the form stored in the database (SLUS_00705)
+    def _db_game_id(self, game_id):
+        return game_id.replace('-', '_')
 
     # *****************************************************************************************************************
-    # Function to copy the game front cover if it is available
-    def _copy_game_cover(self, output_path, game_id, game_name):
-        response = select(f'''SELECT id FROM covers WHERE game_id = "{game_id.replace('-', '_')}";''')
-        if response is not None and response != []:
-            row_id = response[0][0]
-            image_out_path = join(output_path, f'{game_name}.bmp')
-            extract_game_cover_blob(row_id, image_out_path)
+
+    # *****************************************************************************************************************
+    # Function to fill in the disc numbers of the whole game list with a single batched lookup
+    def _resolve_game_metadata(self, game_list):
+        game_metadata = select_game_metadata([self._db_game_id(game.id) for game in game_list if game.id])
+        for game in game_list:
+            metadata = game_metadata.get(self._db_game_id(game.id)) if game.id else None
+            game.disc_number = metadata['disc_number'] if metadata else 0
 
     # *****************************************************************************************************************
 
     # *****************************************************************************************************************
     # Function to create the global game list
-    def _create_game_list(self, selected_path):
+    # progress_callback(done, total, directory_games) is called from the worker threads as each directory is scanned,
+    # once cancel_event is set the directories not yet started are skipped
+    def _create_game_list(self, selected_path, progress_callback=None, cancel_event=None):
         game_list = []
+        scan_cache = ScanCache().load()
 
         # Get all of the sub-dirs from the selected directory
-        subfolders = [f.name for f in scandir(selected_path) if f.is_dir() and not f.name.startswith('.')]
+        subfolders = sorted(f.name for f in scandir(selected_path) if f.is_dir() and not f.name.startswith('.'))
 
         # If the user has selected a single directory with no sub-dirs
         if not (subfolders):
             subfolders = [selected_path]
 
-        for subfolder in subfolders:
-
-            if subfolder != "System Volume Information":
-
-                game_directory_path = join(selected_path, subfolder)
-
-                # Get the cue_sheet for the game (there could be more than 1 game in the directory)
-                #			cue_sheets = [f for f in listdir(game_directory_path) if f.lower().endswith('.cue') and not f.startswith('.')]
-                game_file_list = [f for f in listdir(game_directory_path)]
-
-                game_path = game_directory_path
-                for game_record in game_file_list:
-                    if "(Unl)" not in game_record:
-                        if game_record.lower().endswith('.cue') or game_record.lower().endswith(
-                                '.cu2') and not game_record.startswith('.'):
-                            the_game = self._get_cue_sheet_data(game_directory_path, game_path, selected_path,
-                                                                subfolder, game_record)
-                            # Add the game to the global game_list
-                            game_list += the_game
-                        if game_record.lower().endswith('.iso') and not game_record.startswith('.'):
-                            the_game = self._get_iso_data(game_directory_path, game_path, selected_path, subfolder)
-                            game_list.append(the_game)
-                            self._print_game_details(the_game)
+        subfolders = [subfolder for subfolder in subfolders if subfolder != "System Volume Information"]
+
+        # Each directory is listed, parsed, serial-read and looked up in its own worker so that the I/O latency of
+        # the card reader overlaps. The list is sorted once the scan is done, so the result is deterministic.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.MAX_SCAN_WORKERS) as executor:
+            futures = [executor.submit(self._scan_game_directory, selected_path, subfolder, scan_cache)
+                       for subfolder in subfolders]
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                if cancel_event is not None and cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                if future.cancelled():
+                    continue
+                directory_games = future.result()
+                game_list += directory_games
+                if progress_callback:
+                    progress_callback(done, len(futures), directory_games)
+
+        self._resolve_game_metadata(game_list)
+        for game in game_list:
+            self._classify_game(game)
+        scan_cache.save()
 
-        game_list.sort(key=lambda game_item: game_item.cue_sheet.game_name, reverse=False)
+        game_list.sort(key=lambda game_item: (game_item.cue_sheet.game_name, game_item.cue_sheet.file_path),
+                       reverse=False)
         return game_list
 
+    # *****************************************************************************************************************
+    # Function to find and parse every game in a single directory
+    def _scan_game_directory(self, selected_path, subfolder, scan_cache):
+        directory_games = []
+        game_directory_path = join(selected_path, subfolder)
+
+        # Get the cue_sheet for the game (there could be more than 1 game in the directory)
+        game_file_list = sorted(listdir(game_directory_path))
+
+        # Finish any in-place merge that was interrupted, so the cue sheet matches the bin files again
+        if any(f.endswith(IN_PLACE_JOURNAL_SUFFIX) for f in game_file_list):
+            resume_in_place_merges(game_directory_path)
+            game_file_list = sorted(listdir(game_directory_path))
+
+        game_path = game_directory_path
+        for game_record in game_file_list:
+            if "(Unl)" not in game_record:
+                if game_record.lower().endswith('.cue') or game_record.lower().endswith(
+                        '.cu2') and not game_record.startswith('.'):
+                    the_game = self._get_cue_sheet_data(game_directory_path, game_path, selected_path,
+                                                        subfolder, game_record, scan_cache)
+                    # Add the game to the directory's game list
+                    directory_games += the_game
+                if game_record.lower().endswith('.iso') and not game_record.startswith('.'):
+                    the_game = self._get_iso_data(game_directory_path, game_path, selected_path, subfolder)
+                    directory_games.append(the_game)
+                    self._print_game_details(the_game)
+
+        for game in directory_games:
+            self._classify_game_files(game)
+        return directory_games
+
     def rename_cue_cu2_to_bin(self, game):
         base, ext = splitext(game)
         if ext in ['.cue', '.cu2']:
@@ -355,37 +623,49 @@ class GameHandler(QObject):
         return game
 
     # *****************************************************************************************************************
-    def _get_cue_sheet_data(self, game_directory_path, game_path, selected_path, subfolder, game_record):
+    def _get_cue_sheet_data(self, game_directory_path, game_path, selected_path, subfolder, game_record,
+                            scan_cache=None):
         game_id = None
         temp_game_list = []
         if game_record.lower().endswith('.cue') and not game_record.startswith('.'):
             cue_sheet_path = join(game_directory_path, game_record)
-            game_name_from_cue = self._get_game_name_from_cue(cue_sheet_path, False)
 
-            # Try and get the unique game_id from the first bin file
-            bin_files = read_cue_file(cue_sheet_path)
-            if bin_files:
-                game_id = self.get_game_id(bin_files[0].filename)
-
-            # Try and get the disc number (using data from redump)
+            # Reuse the cached game if the cue sheet and its bin files are unchanged since the last scan
+            cached_game = scan_cache.get(cue_sheet_path) if scan_cache else None
+            if cached_game:
+                cached_game.directory_name = subfolder
+                cached_game.directory_path = selected_path
+                cached_game.cu2_present = exists(self._cu2_path(cue_sheet_path))
+                cached_game.cover_art_present = self.has_cover_art(game_directory_path, cue_sheet_path)
+                self._print_game_details(cached_game)
+                temp_game_list.append(cached_game)
+                return temp_game_list
+
+            # Parse the cue sheet once, the model is kept on the cue_sheet object for the processing steps
+            cue = parse_cue(cue_sheet_path)
+            game_name_from_cue = self._get_game_name_from_cue(cue, False)
+
+            # Try and get the unique game_id and disc collection, reading multi-bin games as one virtual image
+            # The disc number (using data from redump) is resolved for the whole list in _resolve_game_metadata
             disc_number = 0
             disc_collection = []
-            if game_id:
-                disc_number = self._get_disc_number(game_id)
-                disc_collection = self._get_disc_collection(join(game_directory_path, f'{game_name_from_cue}.bin'))
+            if cue.files:
+                with BufferedReader(VirtualDisc(cue)) as disc:
+                    game_id = self.get_game_id(disc)
+                    if game_id:
+                        disc_collection = self._get_disc_collection(disc)
 
             # Check if the game directory already contains a cu2 file
-            cu2_present = exists(join(selected_path, subfolder, f'{cue_sheet_path[-3]}cu2'))
+            cu2_present = exists(self._cu2_path(cue_sheet_path))
 
             # Create the cue_sheet object
-            the_cue_sheet = Cuesheet(game_name_from_cue, cue_sheet_path, game_name_from_cue)
+            the_cue_sheet = Cuesheet(game_name_from_cue, cue_sheet_path, game_name_from_cue, cue)
 
             # Check if the game directory already contains a bmp cover image
             cover_art_present = self.has_cover_art(game_directory_path, cue_sheet_path)
 
             # Add each of the bin_file objects to the cue_sheet object
-            bin_files = read_cue_file(cue_sheet_path)
-            for bin_file in bin_files:
+            for bin_file in cue.files:
                 the_cue_sheet.add_bin_file(Binfile(basename(bin_file.filename), bin_file.filename))
 
             the_game = Game(subfolder, selected_path, game_id, disc_number, disc_collection, the_cue_sheet,
@@ -393,11 +673,18 @@ class GameHandler(QObject):
             self._print_game_details(the_game)
             temp_game_list.append(the_game)
 
+            if scan_cache:
+                scan_cache.put(the_game)
+
         return temp_game_list
 
     def _get_iso_data(self, game_directory_path, game_path, selected_path, subfolder, game):
         pass
 
+    # The CU2 sheet of a game sits next to its cue sheet, with the same name
+    def _cu2_path(self, cue_sheet_path):
+        return splitext(cue_sheet_path)[0] + '.cu2'
+
     def has_cover_art(self, game_directory_path, game):
         # Check if the game directory already contains a bmp cover image
         cover_art_path = join(game_directory_path, game[:-3])
@@ -433,24 +720,29 @@ class GameHandler(QObject):
         return int(game.disc_number) > 0 if game.disc_number is not None else None
 
     # *****************************************************************************************************************
-    # Function to parse the game list and displays the results in a message dialog
-    def _parse_game(self, game):
-        # This function processes an individual game and returns relevant information
-        bin_files = game.cue_sheet.bin_files
-
-        unidentified = game.id is None
-        no_cover = not game.cover_art_present and (game.disc_number is not None and int(game.disc_number) < 2)
-        is_multi_disc = self._is_multi_disc(game)
-        multi_disc = is_multi_disc and int(game.disc_number) == 1
-        multi_bin = len(bin_files) > 1
-        invalid_name = len(game.cue_sheet.game_name) > self.MAX_GAME_NAME_LENGTH or '.' in game.cue_sheet.game_name
-
-        return {'game': game, 'unidentified': unidentified, 'no_cover': no_cover, 'multi_disc': multi_disc,
-                'is_multi_disc': is_multi_disc, 'multi_bin': multi_bin, 'invalid_name': invalid_name}
+    # Function that works out the classification flags of a game once its disc number is known
+    def _classify_game(self, game):
+        self._classify_game_files(game)
+        game.no_cover = not game.cover_art_present and (game.disc_number is not None and int(game.disc_number) < 2)
+        game.is_multi_disc = bool(self._is_multi_disc(game))
+        game.multi_disc = game.is_multi_disc and int(game.disc_number) == 1
+
+    # Function that works out the flags that only depend on the game's files, so they are set before a scanned
+    # directory is reported (and shown) rather than once the whole scan is done
+    def _classify_game_files(self, game):
+        game.unidentified = game.id is None
+        game.multi_bin = len(game.cue_sheet.bin_files) > 1
+        game.invalid_name = len(game.cue_sheet.game_name) > self.MAX_GAME_NAME_LENGTH or '.' in game.cue_sheet.game_name
+
+    def parse_game_list(self, path, progress_callback=None, cancel_event=None):
+        game_list = self._create_game_list(path, progress_callback, cancel_event)
+        return self._poo(game_list)
 
-    def parse_game_list(self, path):
-        game_list = self._create_game_list(path)
+    # *****************************************************************************************************************
 
+    # *****************************************************************************************************************
+    # Function that sorts the game list into its problem categories and returns the details shown after a scan
+    def summarise_game_list(self, game_list):
         games_without_cover = []
         multi_bin_games = []
         invalid_named_games = []
@@ -459,40 +751,26 @@ class GameHandler(QObject):
         multi_discs = []
         multi_disc_games = []
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Submitting tasks for each game in game_list
-            future_to_game = {executor.submit(self._parse_game, game): game for game in game_list}
-
-            for future in concurrent.futures.as_completed(future_to_game):
-                game_data = future.result()
-                game = game_data['game']
-
-                if game_data['unidentified']:
-                    unidentified_games.append(game)
+        for game in game_list:
+            if game.unidentified:
+                unidentified_games.append(game)
 
-                if game_data['no_cover']:
-                    games_without_cover.append(game)
+            if game.no_cover:
+                games_without_cover.append(game)
 
-                if game_data['is_multi_disc']:
-                    multi_discs.append(game)
-                    if game_data['multi_disc']:
-                        multi_disc_games.append(game)
+            if game.is_multi_disc:
+                multi_discs.append(game)
+                if game.multi_disc:
+                    multi_disc_games.append(game)
 
-                if game_data['multi_bin']:
-                    multi_bin_games.append(game)
+            if game.multi_bin:
+                multi_bin_games.append(game)
 
-                if game_data['invalid_name']:
-                    invalid_named_games.append(game)
+            if game.invalid_name:
+                invalid_named_games.append(game)
 
         details = f'''Total Discs Found: {len(game_list)} \nMulti-Disc Games: {len(multi_disc_games)} \nUnidentfied Games: {len(unidentified_games)} \nMulti-bin Games: {len(multi_bin_games)} \nMissing Covers: {len(games_without_cover)} \nInvalid Game Names: {len(invalid_named_games)}'''
 
-        msg_box = QMessageBox()
-        msg_box.setWindowTitle('Game Details')
-        msg_box.setText(details)
-        msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-        msg_box.setFixedWidth(650)
-        msg_box.exec()
-
         # if multi_bin_games:
         #  window.after(0, lambda: merge_bin_files.set(True))  # Schedule GUI update on main thread
         #  window.after(0, lambda: force_cu2.set(True))  # Schedule GUI update on main thread
@@ -511,7 +789,7 @@ class GameHandler(QObject):
         for game in multi_disc_games:
             logging.log(logging.INFO, game.id)
 
-        return self._poo(game_list)
+        return details
 
     # *****************************************************************************************************************
 
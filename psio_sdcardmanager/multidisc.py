@@ -0,0 +1,105 @@
+"""
+Multi-disc set detection
+
+The discs of a scan are grouped into sets in one pass from data that is already in memory: the serial read during
+the scan, the redump metadata in the database and the muli-disc.txt alias map. No bin file is read again.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from os.path import join, exists
+
+from psio_sdcardmanager.db import application_root
+
+MULTI_DISC_ALIAS_PATH = join(application_root(), 'muli-disc.txt')
+MULTI_DISC_FILE = 'MULTIDISC.LST'
+
+# Matches the "(Disc 2)" part of redump names
+DISC_NUMBER_REGEX = re.compile(r'\s*\(Disc (\d+)\)', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class DiscEntry:
+    serial: str
+    # Set title, the redump name without its "(Disc n)" part
+    title: str
+    # 0 when the disc number is unknown
+    disc_number: int
+    # Serial the metadata was taken from (the alias target when the disc has no database entry of its own)
+    set_serial: str
+
+
+# Function that reads the muli-disc.txt alias map ("SLPS_00072 : SLPS_00071") into {serial: canonical serial}
+def load_disc_aliases(alias_path=MULTI_DISC_ALIAS_PATH):
+    aliases = {}
+    if not exists(alias_path):
+        return aliases
+
+    with open(alias_path) as alias_file:
+        for line in alias_file:
+            serial, separator, canonical_serial = line.partition(':')
+            if separator and serial.strip() and canonical_serial.strip():
+                aliases[serial.strip()] = canonical_serial.strip()
+    return aliases
+
+
+# Function that splits a name into its set title and disc number
+def split_disc_name(name):
+    match = DISC_NUMBER_REGEX.search(name)
+    if not match:
+        return name.strip(), 0
+    return DISC_NUMBER_REGEX.sub('', name).strip(), int(match.group(1))
+
+
+# Function that builds the {serial: DiscEntry} index for a list of (serial, name) pairs
+#
+# metadata is the select_game_metadata() result for the serials and their alias targets. A disc without a database
+# entry of its own borrows the title of its alias target, its disc number then comes from the name ("(Disc 2)").
+def build_disc_index(discs, metadata, aliases):
+    disc_index = {}
+    for serial, name in discs:
+        if not serial or serial in disc_index:
+            continue
+
+        set_serial = serial
+        disc_metadata = metadata.get(serial)
+        if not (disc_metadata and disc_metadata['name']) and serial in aliases:
+            set_serial = aliases[serial]
+            disc_metadata = metadata.get(set_serial)
+
+        title, disc_number = split_disc_name(disc_metadata['name'] if disc_metadata and disc_metadata['name']
+                                             else name)
+        if set_serial == serial and disc_metadata and disc_metadata['disc_number']:
+            disc_number = int(disc_metadata['disc_number'])
+
+        disc_index[serial] = DiscEntry(serial, title, disc_number, set_serial)
+    return disc_index
+
+
+# Function that groups items into disc sets, key(item) returns (group, serial) e.g. the directory of a game and its
+# serial. Only sets with more than one disc are returned, each ordered by disc number.
+def group_disc_sets(items, disc_index, key):
+    disc_sets = {}
+    for item in items:
+        group, serial = key(item)
+        entry = disc_index.get(serial)
+        if entry is None:
+            continue
+        disc_sets.setdefault((group, entry.title.lower()), []).append((entry, item))
+
+    grouped = []
+    for discs in disc_sets.values():
+        if len(discs) < 2:
+            continue
+        # Unknown disc numbers go after the known ones, in serial order (the discs of a set have consecutive serials)
+        discs.sort(key=lambda disc: (disc[0].disc_number == 0, disc[0].disc_number, disc[0].serial))
+        grouped.append([item for _, item in discs])
+    return grouped
+
+
+# Function that writes a MULTIDISC.LST file listing the bin files of a set in disc order
+def write_multidisc_file(directory, bin_names):
+    with open(join(directory, MULTI_DISC_FILE), 'w', newline='') as multi_disc_file:
+        multi_disc_file.write('\r'.join(bin_names))
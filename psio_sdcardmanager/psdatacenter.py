@@ -1,13 +1,14 @@
 import logging
 
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-
 logger = logging.getLogger(__name__)
 
 
 def main():
+    # Only needed by this extract script, so importing the module does not load them
+    import pandas as pd
+    import requests
+    from bs4 import BeautifulSoup
+
     logging.basicConfig(level=logging.INFO)
     logger.info("Extract PS1 DataCenter Started")
 
@@ -0,0 +1,133 @@
+"""
+Persistent scan cache, so unchanged games are not re-read on every scan
+"""
+import logging
+# System imports
+from json import dumps, loads
+from os import stat
+from os.path import join, exists
+from sqlite3 import connect, Error
+
+from psio_sdcardmanager.db import application_root
+from psio_sdcardmanager.game_files import Cuesheet, Binfile, Game
+
+SCAN_CACHE_PATH = join(application_root(), 'scan_cache.db')
+
+# Bump whenever the stored record layout changes, older caches are then discarded
+SCAN_CACHE_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+
+class ScanCache:
+    def __init__(self, cache_path=SCAN_CACHE_PATH):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.dirty = {}
+
+    # Load every cached record into memory with a single query
+    def load(self):
+        if not exists(self.cache_path):
+            return self
+        try:
+            conn = connect(self.cache_path)
+            try:
+                if conn.execute('PRAGMA user_version').fetchone()[0] != SCAN_CACHE_VERSION:
+                    return self
+                for cue_path, signature, record in conn.execute('SELECT cue_path, signature, record FROM games'):
+                    self.entries[cue_path] = (signature, record)
+            finally:
+                conn.close()
+        except Error as error:
+            logging.log(logging.ERROR, error)
+        return self
+
+    # Return the cached game for a cue sheet if neither the cue nor any of its bin files have changed
+    def get(self, cue_path):
+        entry = self.entries.get(cue_path)
+        if entry is None:
+            return None
+
+        signature, record = entry
+        record = loads(record)
+        if signature != _file_signature([cue_path] + _record_bin_paths(record)):
+            return None
+
+        return _game_from_record(record)
+
+    # Records are serialised on save(), so fields resolved later in the scan are stored too
+    def put(self, game):
+        cue_path = game.cue_sheet.file_path
+        signature = _file_signature([cue_path] + [bin_file.file_path for bin_file in game.cue_sheet.bin_files])
+        if signature is None:
+            return
+        self.dirty[cue_path] = (signature, game)
+
+    # Write the new records back in one transaction and drop entries for cue sheets that no longer exist
+    def save(self):
+        stale = [cue_path for cue_path in self.entries if cue_path not in self.dirty and not exists(cue_path)]
+        if not self.dirty and not stale:
+            return
+
+        self.dirty = {cue_path: (signature, dumps(_game_to_record(game))) for cue_path, (signature, game) in
+                      self.dirty.items()}
+
+        try:
+            conn = connect(self.cache_path)
+            try:
+                with conn:
+                    if conn.execute('PRAGMA user_version').fetchone()[0] != SCAN_CACHE_VERSION:
+                        conn.execute('DROP TABLE IF EXISTS games')
+                        conn.execute(f'PRAGMA user_version = {SCAN_CACHE_VERSION}')
+                    conn.execute('CREATE TABLE IF NOT EXISTS games '
+                                 '(cue_path TEXT PRIMARY KEY, signature TEXT NOT NULL, record TEXT NOT NULL)')
+                    conn.executemany('INSERT OR REPLACE INTO games VALUES (?, ?, ?)',
+                                     [(cue_path, signature, record) for cue_path, (signature, record) in
+                                      self.dirty.items()])
+                    conn.executemany('DELETE FROM games WHERE cue_path = ?', [(cue_path,) for cue_path in stale])
+            finally:
+                conn.close()
+        except Error as error:
+            logging.log(logging.ERROR, error)
+
+        self.entries.update(self.dirty)
+        for cue_path in stale:
+            del self.entries[cue_path]
+        self.dirty = {}
+
+
+# Builds a (path, size, mtime) signature for a set of files, or None if any of them is missing
+def _file_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            file_stat = stat(path)
+        except OSError:
+            return None
+        signature.append(f'{path}|{file_stat.st_size}|{file_stat.st_mtime_ns}')
+    return '\n'.join(signature)
+
+
+# Records are flat JSON arrays rather than objects, so the field names are not repeated for every game. The
+# classification flags are left out, GameHandler sets them again on every scan.
+def _record_bin_paths(record):
+    return [file_path for _, file_path in record[-1]]
+
+
+def _game_to_record(game):
+    return [game.directory_name, game.directory_path, game.id, game.disc_number, game.disc_collection,
+            game.cover_art_present, game.cu2_present, game.cue_sheet.file_name, game.cue_sheet.file_path,
+            game.cue_sheet.game_name,
+            [[bin_file.file_name, bin_file.file_path] for bin_file in game.cue_sheet.bin_files]]
+
+
+def _game_from_record(record):
+    (directory_name, directory_path, game_id, disc_number, disc_collection, cover_art_present, cu2_present,
+     cue_file_name, cue_file_path, game_name, bin_files) = record
+
+    cue_sheet = Cuesheet(cue_file_name, cue_file_path, game_name)
+    for file_name, file_path in bin_files:
+        cue_sheet.add_bin_file(Binfile(file_name, file_path))
+
+    return Game(directory_name, directory_path, game_id, disc_number, disc_collection, cue_sheet, cover_art_present,
+                cu2_present)
@@ -7,6 +7,8 @@
 #     print(f'Error: {e}')
 
 import re,logging
+import struct
+from contextlib import nullcontext
 logger = logging.getLogger(__name__)
 
 serial_regex = re.compile(
@@ -15,6 +17,15 @@ serial_code_dot_position = 8
 serial_code_length = 11
 buffer_size = 1024 * 1024
 
+# ISO9660 layout used by the SYSTEM.CNF fast path
+raw_sector_size = 2352
+iso_sector_size = 2048
+sector_sync = b'\x00' + b'\xff' * 10 + b'\x00'
+primary_volume_descriptor_sector = 16
+root_directory_record_offset = 156
+system_cnf_name = b'SYSTEM.CNF'
+boot_regex = re.compile(rb'BOOT\s*=\s*([^\r\n]*)')
+
 
 class SerialNotFoundError(Exception):
     pass
@@ -27,9 +38,15 @@ serial_exceptions = {
 }
 
 
+# filepath can also be an already open binary file object, such as a binmerge.VirtualDisc
 def get_serial(filepath):
+    serial = get_serial_from_system_cnf(filepath)
+    if serial:
+        return serial
+
     try:
-        with open(filepath, 'rb') as file:
+        with _open_image(filepath) as file:
+            file.seek(0)
             while True:
                 buffer = file.read(buffer_size)
                 if not buffer:
@@ -40,7 +57,100 @@ def get_serial(filepath):
                     return serial
     except FileNotFoundError as e:
         raise e
-    raise SerialNotFoundError("Serial not found for file: $filename")
+    raise SerialNotFoundError(f"Serial not found for file: {filepath}")
+
+
+# Fast path: read the BOOT= line of SYSTEM.CNF through the ISO9660 filesystem, which only touches a few sectors
+def get_serial_from_system_cnf(filepath):
+    try:
+        with _open_image(filepath) as file:
+            boot_line = read_boot_line(file)
+    except FileNotFoundError as e:
+        raise e
+    except (OSError, ValueError, struct.error) as error:
+        logger.debug(f'SYSTEM.CNF lookup failed for {filepath}: {error}')
+        return None
+
+    if boot_line:
+        serial = find_serial(boot_line)
+        if serial:
+            return normalize_serial(serial)
+    return None
+
+
+# Open files are used as they are and left open for the caller
+def _open_image(filepath):
+    if hasattr(filepath, 'read'):
+        return nullcontext(filepath)
+    return open(filepath, 'rb')
+
+
+def read_boot_line(file):
+    sector_size, data_offset = _detect_sector_layout(file)
+
+    def read_sectors(lba, length):
+        data = bytearray()
+        sector_count = (length + iso_sector_size - 1) // iso_sector_size
+        for sector in range(lba, lba + sector_count):
+            file.seek(sector * sector_size + data_offset)
+            chunk = file.read(iso_sector_size)
+            if len(chunk) < iso_sector_size:
+                raise ValueError(f'Unexpected end of image at sector {sector}')
+            data += chunk
+        return bytes(data[:length])
+
+    pvd = read_sectors(primary_volume_descriptor_sector, iso_sector_size)
+    if pvd[0] != 1 or pvd[1:6] != b'CD001':
+        return None
+
+    root_record = pvd[root_directory_record_offset:root_directory_record_offset + 34]
+    root_lba, root_size = struct.unpack_from('<I4xI', root_record, 2)
+
+    cnf_location = _find_directory_entry(read_sectors(root_lba, root_size), system_cnf_name)
+    if cnf_location is None:
+        return None
+
+    cnf_lba, cnf_size = cnf_location
+    match = boot_regex.search(read_sectors(cnf_lba, min(cnf_size, iso_sector_size)))
+    if match:
+        return match.group(1).decode(errors='ignore').strip()
+    return None
+
+
+# Works out the raw sector size and the offset of the user data within each sector
+def _detect_sector_layout(file):
+    file.seek(0)
+    header = file.read(16)
+    if len(header) < 16 or header[:12] != sector_sync:
+        # Plain 2048 byte per sector ISO image (or a file too short to hold a whole sector header)
+        return iso_sector_size, 0
+    if header[15] == 2:
+        # MODE2/2352: sync (12) + header (4) + subheader (8)
+        return raw_sector_size, 24
+    # MODE1/2352: sync (12) + header (4)
+    return raw_sector_size, 16
+
+
+# Walks the directory records looking for the given file name, returning (lba, size)
+def _find_directory_entry(directory, name):
+    position = 0
+    while position < len(directory):
+        record_length = directory[position]
+        if record_length == 0:
+            # Records never span sectors, so skip to the start of the next one
+            position = (position // iso_sector_size + 1) * iso_sector_size
+            continue
+
+        # A record holds 33 bytes of fields and at least one byte of name, a corrupt length would read past the end
+        if record_length < 34 or position + record_length > len(directory):
+            raise ValueError(f'Invalid directory record at offset {position}')
+
+        name_length = directory[position + 32]
+        record_name = directory[position + 33:position + 33 + name_length].split(b';')[0]
+        if record_name.upper() == name:
+            return struct.unpack_from('<I4xI', directory, position + 2)
+        position += record_length
+    return None
 
 
 def find_serial(s):
@@ -0,0 +1,102 @@
+"""
+Qt workers that run GameHandler scans and processing off the GUI thread
+"""
+import logging
+from threading import Event
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+# Base worker: the work callable runs in the worker thread and its result is emitted through finished (failed on an
+# error). GameHandler calls back from its own thread pools, the signals queue those calls onto the GUI thread.
+class GameHandlerWorker(QObject):
+    # done, total
+    progress = pyqtSignal(int, int)
+    status = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, game_handler, work):
+        super().__init__()
+        self.game_handler = game_handler
+        self.work = work
+        self.cancel_event = Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def run(self):
+        try:
+            result = self.work()
+        except Exception as error:
+            logging.log(logging.ERROR, error)
+            self.failed.emit(str(error))
+            return
+        self.finished.emit(result)
+
+
+# Scans a library, finished emits (game_list, details)
+class ScanWorker(GameHandlerWorker):
+    # The games found in each directory as soon as it has been scanned
+    games_found = pyqtSignal(list)
+
+    def __init__(self, game_handler, path):
+        super().__init__(game_handler, self._scan)
+        self.path = path
+
+    def _scan(self):
+        game_list = self.game_handler.parse_game_list(self.path, self._directory_scanned, self.cancel_event)
+        return game_list, self.game_handler.summarise_game_list(game_list)
+
+    def _directory_scanned(self, done, total, directory_games):
+        self.progress.emit(done, total)
+        if directory_games:
+            self.games_found.emit(directory_games)
+
+
+# Runs process_games over a game list, options are the keyword arguments of process_games
+class ProcessWorker(GameHandlerWorker):
+    # Each game once it has passed through every stage
+    game_processed = pyqtSignal(object)
+
+    def __init__(self, game_handler, game_list, **options):
+        super().__init__(game_handler, self._process)
+        self.game_list = game_list
+        self.options = options
+
+    def _process(self):
+        self.game_handler.process_games(game_list=self.game_list, progress_callback=self._game_processed,
+                                        status_callback=self._stage_started, cancel_event=self.cancel_event,
+                                        **self.options)
+        return self.game_list
+
+    def _game_processed(self, done, total, game):
+        self.progress.emit(done, total)
+        self.game_processed.emit(game)
+
+    def _stage_started(self, stage, game):
+        self.status.emit(f'{stage} - {game.cue_sheet.game_name}')
+
+
+# Function that moves a worker to a new thread and starts it, the thread quits once the worker is done
+#
+# Qt deletes the worker and the thread once the thread has stopped, thread_finished is called at that point too (it is
+# connected before the thread starts, so it cannot be missed). Keep the references until then: a QThread that is
+# garbage collected while it is still running takes the application down with it.
+def start_worker(worker, thread_finished=None):
+    thread = QThread()
+    worker.moveToThread(thread)
+    thread.started.connect(worker.run)
+    worker.finished.connect(thread.quit)
+    worker.failed.connect(thread.quit)
+    thread.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+    if thread_finished is not None:
+        thread.finished.connect(thread_finished)
+    thread.start()
+    return thread
@@ -0,0 +1,28 @@
+from functools import partial
+
+import pytest
+
+from psio_sdcardmanager import db, gamehandler
+from psio_sdcardmanager.covers import CoverCache
+from psio_sdcardmanager.scan_cache import ScanCache
+
+
+# A stand-in application directory: the database, scan cache and cover cache are kept under tmp_path
+@pytest.fixture
+def application_directory(tmp_path, monkeypatch):
+    db.close_connections()
+    monkeypatch.setattr(db, 'DATABASE_FULL_PATH', str(tmp_path / 'psio_assist.db'))
+    monkeypatch.setattr(gamehandler, 'ScanCache', partial(ScanCache, str(tmp_path / 'scan_cache.db')))
+    monkeypatch.setattr(gamehandler, 'CoverCache', partial(CoverCache, str(tmp_path / 'cover_cache')))
+    yield tmp_path
+    db.close_connections()
+
+
+# A stand-in data directory for the database and its split-files
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    db.close_connections()
+    monkeypatch.setattr(db, 'DATABASE_PATH', str(tmp_path))
+    monkeypatch.setattr(db, 'DATABASE_FULL_PATH', str(tmp_path / db.DATABASE_FILE))
+    yield tmp_path
+    db.close_connections()
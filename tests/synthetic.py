@@ -0,0 +1,219 @@
+"""
+Synthetic PlayStation disc images and SD card libraries for the benchmarks
+
+The images are raw MODE2/2352 bin files with just enough ISO9660 (a primary volume descriptor, a root directory and a
+SYSTEM.CNF) for the serial lookups. Everything else is zero filled and written sparse, so large images are cheap to
+create. write_library builds a whole SD card from them, with a matching stand-in psio_assist.db from write_database.
+"""
+import sqlite3
+import struct
+from dataclasses import dataclass
+from os import mkdir
+from os.path import join
+
+from psio_sdcardmanager.covers import Image, encode_bmp
+from psio_sdcardmanager.cue2cu2 import cue2cu2_bytes
+
+RAW_SECTOR_SIZE = 2352
+ISO_SECTOR_SIZE = 2048
+SECTOR_SYNC = b'\x00' + b'\xff' * 10 + b'\x00'
+
+PRIMARY_VOLUME_DESCRIPTOR_SECTOR = 16
+ROOT_DIRECTORY_SECTOR = 22
+SYSTEM_CNF_SECTOR = 23
+
+# Frames per second of CD audio, the unit of cue sheet timestamps
+FRAMES_PER_SECOND = 75
+
+
+# Function that builds a raw MODE2/2352 (or MODE1/2352) sector around up to 2048 bytes of user data
+def raw_sector(data=b'', mode2=True):
+    data = data.ljust(ISO_SECTOR_SIZE, b'\0')
+    header = b'\0\x02\0' + (b'\x02' if mode2 else b'\x01')
+    subheader = b'\0' * 8 if mode2 else b''
+    padding = b'\0' * (RAW_SECTOR_SIZE - len(SECTOR_SYNC) - len(header) - len(subheader) - ISO_SECTOR_SIZE)
+    return SECTOR_SYNC + header + subheader + data + padding
+
+
+def _directory_record(name, lba, size, flags=0):
+    name_length = len(name)
+    record = bytearray(33 + name_length + (1 - name_length % 2))
+    record[0] = len(record)
+    struct.pack_into('<I', record, 2, lba)
+    struct.pack_into('<I', record, 10, size)
+    record[25] = flags
+    record[32] = name_length
+    record[33:33 + name_length] = name
+    return bytes(record)
+
+
+# Function that returns the sectors (lba: user data) of a minimal ISO9660 filesystem holding SYSTEM.CNF
+def iso_sectors(serial, disc_collection=()):
+    primary_volume_descriptor = bytearray(ISO_SECTOR_SIZE)
+    primary_volume_descriptor[0] = 1
+    primary_volume_descriptor[1:6] = b'CD001'
+    primary_volume_descriptor[156:190] = _directory_record(b'\0', ROOT_DIRECTORY_SECTOR, ISO_SECTOR_SIZE, 2)
+
+    system_cnf = f'BOOT = cdrom:\\{serial};1\r\nTCB = 4\r\nEVENT = 10\r\nSTACK = 801FFFF0\r\n'.encode()
+    root_directory = (_directory_record(b'\0', ROOT_DIRECTORY_SECTOR, ISO_SECTOR_SIZE, 2) +
+                      _directory_record(b'\1', ROOT_DIRECTORY_SECTOR, ISO_SECTOR_SIZE, 2) +
+                      _directory_record(b'SYSTEM.CNF;1', SYSTEM_CNF_SECTOR, len(system_cnf)))
+
+    sectors = {
+        PRIMARY_VOLUME_DESCRIPTOR_SECTOR: bytes(primary_volume_descriptor),
+        ROOT_DIRECTORY_SECTOR: root_directory,
+        SYSTEM_CNF_SECTOR: system_cnf,
+    }
+    # Multi-disc games list the serials of every disc of the set ahead of their own SYSTEM.CNF
+    if disc_collection:
+        sectors[PRIMARY_VOLUME_DESCRIPTOR_SECTOR + 1] = ' '.join(disc_collection).encode()
+    return sectors
+
+
+# Function that writes a synthetic disc image of size bytes (rounded down to whole sectors)
+#
+# serial=None gives an image without any serial. With iso=True the serial is in SYSTEM.CNF, otherwise the image has
+# no filesystem and the serial is only found by scanning for it, at serial_offset bytes into the image.
+def write_disc_image(path, size, serial='SLUS_007.05', iso=True, serial_offset=0, disc_collection=(), mode2=True):
+    sector_count = max(size // RAW_SECTOR_SIZE, SYSTEM_CNF_SECTOR + 1)
+
+    sectors = {}
+    if serial is not None and iso:
+        sectors = iso_sectors(serial, disc_collection)
+    elif serial is not None:
+        sectors = {min(serial_offset // RAW_SECTOR_SIZE, sector_count - 1): f'cdrom:\\{serial};1'.encode()}
+
+    # The sector layout (MODE1/MODE2) is detected from the header of the first sector
+    sectors.setdefault(0, b'')
+
+    with open(path, 'wb') as image_file:
+        image_file.truncate(sector_count * RAW_SECTOR_SIZE)
+        for lba, data in sorted(sectors.items()):
+            image_file.seek(lba * RAW_SECTOR_SIZE)
+            image_file.write(raw_sector(data, mode2))
+    return sector_count * RAW_SECTOR_SIZE
+
+
+# Function that writes an audio track of the given number of sectors (sparse, i.e. silence)
+def write_audio_track(path, sector_count):
+    with open(path, 'wb') as track_file:
+        track_file.truncate(sector_count * RAW_SECTOR_SIZE)
+    return sector_count * RAW_SECTOR_SIZE
+
+
+def cue_timestamp(sectors):
+    return (f'{sectors // (60 * FRAMES_PER_SECOND):02d}:{sectors // FRAMES_PER_SECOND % 60:02d}:'
+            f'{sectors % FRAMES_PER_SECOND:02d}')
+
+
+# Function that writes a redump style cue sheet, one FILE per track: a MODE2/2352 data track then audio tracks
+def write_cue_sheet(path, bin_names):
+    lines = []
+    for track_number, bin_name in enumerate(bin_names, start=1):
+        lines.append(f'FILE "{bin_name}" BINARY')
+        if track_number == 1:
+            lines += [f'  TRACK {track_number:02d} MODE2/2352', '    INDEX 01 00:00:00']
+        else:
+            # Audio tracks start with a two second pregap
+            lines += [f'  TRACK {track_number:02d} AUDIO', '    INDEX 00 00:00:00',
+                      f'    INDEX 01 {cue_timestamp(2 * FRAMES_PER_SECOND)}']
+    with open(path, 'w', newline='\r\n') as cue_file:
+        cue_file.write('\n'.join(lines) + '\n')
+
+
+# Function that writes a complete game (cue sheet, data track and audio tracks) into directory
+#
+# Returns the cue sheet path. A single track game gets a plain "<name>.bin", multi-track games the redump
+# "<name> (Track n).bin" names.
+def write_game(directory, name, data_size, serial='SLUS_007.05', audio_tracks=0, audio_track_size=0,
+               disc_collection=()):
+    if audio_tracks:
+        bin_names = [f'{name} (Track {track_number})' for track_number in range(1, audio_tracks + 2)]
+    else:
+        bin_names = [name]
+    bin_names = [f'{bin_name}.bin' for bin_name in bin_names]
+
+    write_disc_image(join(directory, bin_names[0]), data_size, serial, disc_collection=disc_collection)
+    for bin_name in bin_names[1:]:
+        write_audio_track(join(directory, bin_name), max(audio_track_size // RAW_SECTOR_SIZE, 2 * FRAMES_PER_SECOND))
+
+    cue_path = join(directory, f'{name}.cue')
+    write_cue_sheet(cue_path, bin_names)
+    return cue_path
+
+
+@dataclass(frozen=True, slots=True)
+class LibraryDisc:
+    serial: str
+    # Name in the database, the files on the card are named file_name (without the region)
+    name: str
+    disc_number: int
+    in_database: bool
+    has_cover: bool
+    # Game folder, relative to the library root
+    directory: str
+    file_name: str
+
+
+# Function that builds a PSIO cover (80x84, 24 bit) whose colours depend on seed
+def cover_bmp(seed):
+    pixels = bytearray()
+    for y in range(84):
+        for x in range(80):
+            pixels += bytes(((x + seed) % 256, (y * 3 + seed) % 256, (x + y + seed * 7) % 256))
+    return encode_bmp(Image(80, 84, pixels))
+
+
+# Function that fills root with game_count game folders and returns a LibraryDisc per disc
+#
+# The mix is fixed by the folder number, so every library of a given size is the same:
+#   every 10th folder is a two disc set (both discs list each other's serials),
+#   every 7th game is multi-bin (a data track and three audio tracks),
+#   every 4th single bin game already has its CU2 sheet and every 3rd game its BMP cover,
+#   every 25th game is missing from the database and every 5th one has no cover in it.
+def write_library(root, game_count, data_size):
+    discs = []
+    for number in range(game_count):
+        directory_name = f'Synthetic Game {number:04d}'
+        directory = join(root, directory_name)
+        mkdir(directory)
+
+        disc_count = 2 if number % 10 == 9 else 1
+        serial_numbers = [number * 2 + disc for disc in range(disc_count)]
+        serials = [f'SLUS_{serial_number // 100:03d}.{serial_number % 100:02d}' for serial_number in serial_numbers]
+        for disc, serial in enumerate(serials, start=1):
+            name = f'Synthetic Game {number:04d}' + (f' (Disc {disc})' if disc_count > 1 else '')
+            audio_tracks = 3 if number % 7 == 3 else 0
+
+            cue_path = write_game(directory, name, data_size, serial, audio_tracks=audio_tracks,
+                                  disc_collection=serials if disc_count > 1 else ())
+            if not audio_tracks and number % 4 == 1:
+                with open(join(directory, f'{name}.cu2'), 'wb') as cu2_file:
+                    cu2_file.write(cue2cu2_bytes(cue_path, f'{name}.bin'))
+            if number % 3 == 0:
+                with open(join(directory, f'{name}.bmp'), 'wb') as cover_file:
+                    cover_file.write(cover_bmp(number))
+
+            database_name = f'Synthetic Game {number:04d} (USA)' + (f' (Disc {disc})' if disc_count > 1 else '')
+            discs.append(LibraryDisc(serial, database_name, disc if disc_count > 1 else 0, number % 25 != 24,
+                                     number % 5 != 4, directory_name, name))
+    return discs
+
+
+# Function that writes a stand-in psio_assist.db holding the games and covers rows of the given discs
+def write_database(path, discs):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute('CREATE TABLE games (id INTEGER PRIMARY KEY, game_id TEXT, name TEXT, disc_number INTEGER)')
+            conn.execute('CREATE TABLE covers (id INTEGER PRIMARY KEY, game_id TEXT, psio BLOB)')
+            for number, disc in enumerate(discs):
+                if not disc.in_database:
+                    continue
+                game_id = disc.serial.replace('.', '')
+                conn.execute('INSERT INTO games (game_id, name, disc_number) VALUES (?, ?, ?)',
+                             (game_id, disc.name, disc.disc_number))
+                if disc.has_cover:
+                    conn.execute('INSERT INTO covers (game_id, psio) VALUES (?, ?)', (game_id, cover_bmp(number)))
+    finally:
+        conn.close()
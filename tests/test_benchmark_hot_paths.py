@@ -0,0 +1,172 @@
+"""
+Throughput benchmarks of the per-disc hot paths, run over synthetic images (see synthetic.py)
+
+    python -m pytest tests/test_benchmark_hot_paths.py --benchmark-autosave
+    python -m pytest tests/test_benchmark_hot_paths.py --benchmark-json=benchmark.json
+
+--benchmark-autosave keeps every run as JSON under .benchmarks/, pytest-benchmark compare then shows the regressions
+between two of them. Besides the timings (ops/s) each result records the bytes handled and the MB/s in extra_info, the
+serial lookups count the bytes they actually read.
+The images default to 32 MiB, PSIO_BENCHMARK_IMAGE_MB=650 benchmarks full size CD images.
+"""
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from psio_sdcardmanager.binmerge import read_cue_file, merge_files, VirtualDisc
+from psio_sdcardmanager.cue2cu2 import start_cue2cu2
+from psio_sdcardmanager.gamehandler import GameHandler
+from psio_sdcardmanager.serial_finder import get_serial, SerialNotFoundError
+from tests.synthetic import RAW_SECTOR_SIZE, write_disc_image, write_game
+
+IMAGE_SIZE = int(os.environ.get('PSIO_BENCHMARK_IMAGE_MB', 32)) * 1024 * 1024
+AUDIO_TRACK_SIZE = 4 * 1024 * 1024
+
+# (name, write_disc_image options), the serial offsets only matter for images without a filesystem
+SERIAL_LAYOUTS = [
+    ('system_cnf', {}),
+    ('raw_start', {'iso': False, 'serial_offset': 0}),
+    ('raw_middle', {'iso': False, 'serial_offset': IMAGE_SIZE // 2}),
+    ('raw_end', {'iso': False, 'serial_offset': IMAGE_SIZE - RAW_SECTOR_SIZE}),
+]
+
+TRACK_LAYOUTS = [1, 4, 16]
+
+
+# Function that records the bytes a benchmark handled per call and its throughput in MB/s
+def _record_throughput(benchmark, size):
+    benchmark.extra_info['bytes'] = size
+    if benchmark.stats is not None:
+        benchmark.extra_info['mb_per_s'] = size / 1_000_000 / benchmark.stats.stats.mean
+
+
+# Open image that counts the bytes read through it, the lookups take open files as well as paths
+class _CountingFile:
+    def __init__(self, file):
+        self.file = file
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.file.readline(size)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+
+# Function that returns how many bytes of an image a lookup reads, from one untimed call (the fast paths only read a
+# few sectors, so the image size says nothing about their throughput)
+def _bytes_read(lookup, image_path):
+    with open(image_path, 'rb') as image_file:
+        counting_file = _CountingFile(image_file)
+        try:
+            lookup(counting_file)
+        except SerialNotFoundError:
+            pass
+    return counting_file.bytes_read
+
+
+@pytest.fixture(scope='module')
+def images(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('images')
+    paths = {}
+    for name, options in SERIAL_LAYOUTS:
+        paths[name] = str(directory / f'{name}.bin')
+        write_disc_image(paths[name], IMAGE_SIZE, **options)
+    paths['no_serial'] = str(directory / 'no_serial.bin')
+    write_disc_image(paths['no_serial'], IMAGE_SIZE, serial=None)
+    paths['disc_collection'] = str(directory / 'disc_collection.bin')
+    write_disc_image(paths['disc_collection'], IMAGE_SIZE, 'SLUS_009.06',
+                     disc_collection=('SLUS_009.06', 'SLUS_009.07', 'SLUS_009.08'))
+    return paths
+
+
+@pytest.fixture(scope='module')
+def games(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('games')
+    cue_paths = {}
+    for track_count in TRACK_LAYOUTS:
+        game_directory = directory / f'tracks_{track_count}'
+        game_directory.mkdir()
+        cue_paths[track_count] = write_game(str(game_directory), f'Game {track_count}', IMAGE_SIZE,
+                                            audio_tracks=track_count - 1, audio_track_size=AUDIO_TRACK_SIZE)
+    return cue_paths
+
+
+@pytest.mark.parametrize('layout', [name for name, _ in SERIAL_LAYOUTS])
+def test_get_serial(benchmark, images, layout):
+    assert benchmark(get_serial, images[layout]) == 'SLUS_007.05'
+    _record_throughput(benchmark, _bytes_read(get_serial, images[layout]))
+
+
+def test_get_serial_not_found(benchmark, images):
+    def get_missing_serial():
+        with pytest.raises(SerialNotFoundError):
+            get_serial(images['no_serial'])
+
+    benchmark(get_missing_serial)
+    _record_throughput(benchmark, _bytes_read(get_serial, images['no_serial']))
+
+
+def test_get_disc_collection(benchmark, images):
+    game_handler = GameHandler()
+    assert benchmark(game_handler._get_disc_collection, images['disc_collection']) == [
+        'SLUS_00906', 'SLUS_00907', 'SLUS_00908']
+    _record_throughput(benchmark, _bytes_read(game_handler._get_disc_collection, images['disc_collection']))
+
+
+@pytest.mark.parametrize('track_count', TRACK_LAYOUTS)
+def test_read_cue_file(benchmark, games, track_count):
+    files = benchmark(read_cue_file, games[track_count])
+    assert len(files) == track_count
+
+
+@pytest.mark.parametrize('track_count', TRACK_LAYOUTS)
+def test_start_cue2cu2(benchmark, games, track_count, tmp_path):
+    cue_path = games[track_count]
+    bin_name = os.path.basename(cue_path)[:-4] + '.bin'
+
+    if track_count > 1:
+        # Multi-bin games are converted through a VirtualDisc, as if they were already merged (the cue is kept)
+        with VirtualDisc.from_cue(cue_path) as virtual_disc:
+            assert benchmark(start_cue2cu2, cue_path, bin_name, virtual_disc)
+        return
+
+    # start_cue2cu2 replaces the cue sheet with the CU2 sheet, so each round starts from a fresh copy
+    backup_path = str(tmp_path / 'backup.cue')
+    shutil.copyfile(cue_path, backup_path)
+
+    def restore_cue_sheet():
+        shutil.copyfile(backup_path, cue_path)
+        return (cue_path, bin_name), {}
+
+    assert benchmark.pedantic(start_cue2cu2, setup=restore_cue_sheet, rounds=50)
+    shutil.copyfile(backup_path, cue_path)
+
+
+@pytest.mark.parametrize('track_count', TRACK_LAYOUTS)
+def test_merge_files(benchmark, games, track_count, tmp_path):
+    files = read_cue_file(games[track_count])
+    merged_path = str(tmp_path / 'merged.bin')
+    size = sum(bin_file.size for bin_file in files)
+
+    def remove_merged_file():
+        if os.path.exists(merged_path):
+            os.remove(merged_path)
+        return (merged_path, files), {}
+
+    assert benchmark.pedantic(merge_files, setup=remove_merged_file, rounds=5)
+    assert os.path.getsize(merged_path) == size
+    _record_throughput(benchmark, size)
@@ -0,0 +1,107 @@
+"""
+End-to-end benchmarks of a whole SD card: GameHandler.parse_game_list and process_games over synthetic libraries
+
+    python -m pytest tests/test_benchmark_library.py --benchmark-autosave
+    python -m pytest tests/test_benchmark_library.py --benchmark-cprofile=cumtime --benchmark-json=library.json
+
+Each library size is benchmarked separately and us_per_game is recorded in extra_info, so a scan that stops scaling
+linearly shows up as a growing us_per_game. --benchmark-cprofile stores the top functions of each run in the JSON to
+show where the time goes. PSIO_BENCHMARK_LIBRARY_SIZES (e.g. "10,100") and PSIO_BENCHMARK_LIBRARY_IMAGE_MB change
+the library sizes and the size of each disc image.
+"""
+import itertools
+import logging
+import os
+import shutil
+from os.path import exists, join
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from psio_sdcardmanager.gamehandler import GameHandler
+from psio_sdcardmanager.multidisc import MULTI_DISC_FILE
+from tests.synthetic import write_database, write_library
+
+LIBRARY_SIZES = [int(size) for size in os.environ.get('PSIO_BENCHMARK_LIBRARY_SIZES', '10,100,1000').split(',')]
+IMAGE_SIZE = int(os.environ.get('PSIO_BENCHMARK_LIBRARY_IMAGE_MB', 1)) * 1024 * 1024
+ROUNDS = 3
+
+
+# Function that writes a library of game_count games into application_directory/library_name and the database for
+# it, returning the library path and its LibraryDisc list
+def _write_library(application_directory, library_name, game_count):
+    library_path = application_directory / library_name
+    library_path.mkdir()
+    discs = write_library(str(library_path), game_count, IMAGE_SIZE)
+    if not (application_directory / 'psio_assist.db').exists():
+        write_database(str(application_directory / 'psio_assist.db'), discs)
+    return str(library_path), discs
+
+
+# Function that checks a processed library: every disc is a single bin with a CU2 sheet, every disc with a cover in
+# the database has its BMP and every two disc set has its MULTIDISC.LST
+def _assert_processed(library_path, discs):
+    for disc in discs:
+        directory = join(library_path, disc.directory)
+        assert exists(join(directory, f'{disc.file_name}.bin')), f'{disc.file_name} was not merged'
+        assert exists(join(directory, f'{disc.file_name}.cu2')), f'{disc.file_name} has no CU2 sheet'
+        if disc.in_database and disc.has_cover:
+            assert exists(join(directory, f'{disc.file_name}.bmp')), f'{disc.file_name} has no cover'
+        if disc.disc_number:
+            assert exists(join(directory, MULTI_DISC_FILE)), f'{disc.directory} has no {MULTI_DISC_FILE}'
+
+
+def _record_games(benchmark, game_count, disc_count):
+    benchmark.extra_info['games'] = game_count
+    benchmark.extra_info['discs'] = disc_count
+    if benchmark.stats is not None:
+        benchmark.extra_info['us_per_game'] = benchmark.stats.stats.mean * 1_000_000 / game_count
+
+
+@pytest.mark.parametrize('game_count', LIBRARY_SIZES)
+@pytest.mark.parametrize('scan_cache', ['cold', 'warm'])
+def test_parse_game_list(benchmark, application_directory, game_count, scan_cache):
+    library_path, discs = _write_library(application_directory, 'sdcard', game_count)
+    disc_count = len(discs)
+    scan_cache_path = application_directory / 'scan_cache.db'
+    game_handler = GameHandler()
+
+    # A warm scan is a rescan of an unchanged card, so every game comes from the scan cache
+    if scan_cache == 'warm':
+        game_handler.parse_game_list(library_path)
+
+    def reset_scan_cache():
+        if scan_cache == 'cold' and scan_cache_path.exists():
+            scan_cache_path.unlink()
+
+    game_list = benchmark.pedantic(game_handler.parse_game_list, args=(library_path,), setup=reset_scan_cache,
+                                   rounds=ROUNDS)
+    assert len(game_list) == disc_count
+    _record_games(benchmark, game_count, disc_count)
+
+
+@pytest.mark.parametrize('game_count', LIBRARY_SIZES)
+def test_process_games(benchmark, application_directory, game_count, caplog):
+    game_handler = GameHandler()
+    library_numbers = itertools.count()
+    libraries = []
+
+    # process_games changes the card (merges, CU2 sheets, covers), so every round gets a fresh one
+    def write_scanned_library():
+        library_path, discs = _write_library(application_directory, f'sdcard_{next(library_numbers)}', game_count)
+        libraries.append((library_path, discs))
+        shutil.rmtree(application_directory / 'cover_cache', ignore_errors=True)
+        game_list = game_handler.parse_game_list(library_path)
+        caplog.clear()
+        # Every task except the redump renaming, so the files keep the names the checks expect
+        return (True, True, False, True, True, game_list), {'create_multi_disc': True}
+
+    # Each round is checked as soon as it has run, a failed game is logged as an error by the pipeline
+    def check_processed_library(*args, **kwargs):
+        assert not [record.getMessage() for record in caplog.records if record.levelno >= logging.ERROR]
+        _assert_processed(*libraries[-1])
+
+    benchmark.pedantic(game_handler.process_games, setup=write_scanned_library, teardown=check_processed_library,
+                       rounds=ROUNDS)
+    _record_games(benchmark, game_count, len(libraries[0][1]))
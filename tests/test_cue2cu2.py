@@ -0,0 +1,35 @@
+"""
+CU2 sheets compared with the output of the original cue2cu2 writer
+"""
+from psio_sdcardmanager.cue2cu2 import start_cue2cu2, cue2cu2_bytes
+from tests.synthetic import RAW_SECTOR_SIZE, write_disc_image
+
+# A data track and an audio track that starts straight at INDEX 01, with no INDEX 00 or PREGAP
+CUE_WITHOUT_PREGAP = '''FILE "Game.bin" BINARY
+  TRACK 01 MODE2/2352
+    INDEX 01 00:00:00
+  TRACK 02 AUDIO
+    INDEX 01 10:00:00
+'''
+
+# What the original writer made of it: a zero length pregap, at the start of track 2
+CU2_WITHOUT_PREGAP = (b'ntracks 2\r\nsize\t   10:06:50\r\ndata1\t   00:02:00\r\n'
+                      b'pregap02\t10:01:75\r\ntrack02\t10:01:75\r\n\r\ntrk end\t 10:08:50')
+
+
+def _write_game(directory, cue_text):
+    write_disc_image(str(directory / 'Game.bin'), 45500 * RAW_SECTOR_SIZE)
+    cue_path = directory / 'Game.cue'
+    cue_path.write_text(cue_text, newline='\r\n')
+    return str(cue_path)
+
+
+def test_track_without_index_00(tmp_path):
+    cue_path = _write_game(tmp_path, CUE_WITHOUT_PREGAP)
+    warnings = []
+
+    assert cue2cu2_bytes(cue_path, 'Game.bin', warnings=warnings) == CU2_WITHOUT_PREGAP
+    assert len(warnings) == 1 and 'track 2' in warnings[0]
+
+    assert start_cue2cu2(cue_path, 'Game.bin')
+    assert (tmp_path / 'Game.cu2').read_bytes() == CU2_WITHOUT_PREGAP
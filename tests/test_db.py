@@ -0,0 +1,84 @@
+"""
+Database merge from the split-files shipped in data/ (byte chunks of one psio_assist.db, listed in fs_manifest.csv)
+"""
+import sqlite3
+
+from psio_sdcardmanager import db
+from tests.synthetic import LibraryDisc, write_database
+
+SPLIT_COUNT = 4
+
+
+# Function that writes a database and splits it into SPLIT_COUNT byte chunks plus a filesplit manifest, the way the
+# files in data/ were made. Returns the rows of the games table.
+def _write_database_splits(data_path):
+    discs = [LibraryDisc(f'SLUS_{number // 100:03d}.{number % 100:02d}', f'Game {number} (USA)', 0, True, True,
+                         f'Game {number}', f'Game {number}') for number in range(200)]
+    database_path = data_path / 'whole.db'
+    write_database(str(database_path), discs)
+
+    with sqlite3.connect(database_path) as conn:
+        games = conn.execute('SELECT game_id, name, disc_number FROM games ORDER BY game_id').fetchall()
+    conn.close()
+
+    data = database_path.read_bytes()
+    database_path.unlink()
+    split_size = -(-len(data) // SPLIT_COUNT)
+    manifest = ['filename,filesize,encoding,header']
+    for number in range(SPLIT_COUNT):
+        chunk = data[number * split_size:(number + 1) * split_size]
+        (data_path / f'psio_assist_{number + 1}.db').write_bytes(chunk)
+        manifest.append(f'psio_assist_{number + 1}.db,{len(chunk)},,')
+    (data_path / db.DATABASE_MANIFEST_FILE).write_text('\n'.join(manifest) + '\n')
+    return games
+
+
+def test_merge_database_concatenates_the_splits(data_path):
+    games = _write_database_splits(data_path)
+    progress = []
+
+    db.ensure_database_exists(lambda done, total: progress.append((done, total)))
+
+    assert progress == [(number, SPLIT_COUNT) for number in range(1, SPLIT_COUNT + 1)]
+    assert db.select('SELECT game_id, name, disc_number FROM games ORDER BY game_id') == games
+    assert db._database_layout_version() == db.DATABASE_LAYOUT_VERSION
+    assert sorted(path.name for path in data_path.iterdir()) == sorted([db.DATABASE_FILE, db.DATABASE_MANIFEST_FILE])
+
+
+def test_merge_database_keeps_the_splits_when_one_is_the_wrong_size(data_path):
+    _write_database_splits(data_path)
+    with open(data_path / 'psio_assist_2.db', 'ab') as split_file:
+        split_file.write(b'\0')
+
+    assert not db._merge_database()
+    assert not (data_path / db.DATABASE_FILE).exists()
+    assert not (data_path / f'{db.DATABASE_FILE}.tmp').exists()
+    assert all((data_path / f'psio_assist_{number}.db').exists() for number in range(1, SPLIT_COUNT + 1))
+
+
+# The two discs of a set in the alias map have their own (identical) cover rows, the set's cover is read once
+def test_export_game_covers_reads_the_cover_of_a_set_once(data_path, monkeypatch):
+    discs = [LibraryDisc('SLPS_000.71', 'Set (Japan) (Disc 1)', 1, True, True, 'Set', 'Set (Disc 1)'),
+             LibraryDisc('SLPS_000.72', 'Set (Japan) (Disc 2)', 2, True, True, 'Set', 'Set (Disc 2)'),
+             LibraryDisc('SLPS_000.73', 'Other (Japan)', 0, True, True, 'Other', 'Other')]
+    write_database(str(data_path / db.DATABASE_FILE), discs)
+    with sqlite3.connect(data_path / db.DATABASE_FILE) as conn:
+        conn.execute("UPDATE covers SET psio = (SELECT psio FROM covers WHERE game_id = 'SLPS_00071') "
+                     "WHERE game_id = 'SLPS_00072'")
+    conn.close()
+
+    cover_reads = []
+    stream_cover_blob = db._stream_cover_blob
+
+    def counting_stream_cover_blob(conn, row_id, destination):
+        cover_reads.append(row_id)
+        return stream_cover_blob(conn, row_id, destination)
+
+    monkeypatch.setattr(db, '_stream_cover_blob', counting_stream_cover_blob)
+
+    cover_requests = [(disc.serial.replace('.', ''), str(data_path / f'{disc.file_name}.bmp')) for disc in discs]
+    written = db.export_game_covers(cover_requests, aliases={'SLPS_00072': 'SLPS_00071'})
+
+    assert sorted(written) == sorted(destination for _, destination in cover_requests)
+    assert len(cover_reads) == 2
+    assert (data_path / 'Set (Disc 1).bmp').read_bytes() == (data_path / 'Set (Disc 2).bmp').read_bytes()
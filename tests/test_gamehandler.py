@@ -0,0 +1,87 @@
+"""
+GameHandler scans and batch operations over small synthetic SD cards (see synthetic.py)
+"""
+import logging
+import time
+from os.path import exists, join
+
+import pytest
+
+from psio_sdcardmanager.gamehandler import GameHandler
+from tests.synthetic import write_database, write_game, write_library
+
+IMAGE_SIZE = 64 * 2352
+
+
+@pytest.fixture
+def library(application_directory):
+    library_path = application_directory / 'sdcard'
+    library_path.mkdir()
+    discs = write_library(str(library_path), 11, IMAGE_SIZE)
+    write_database(str(application_directory / 'psio_assist.db'), discs)
+    return str(library_path), discs
+
+
+def _has_cu2(library_path, disc):
+    return exists(join(library_path, disc.directory, f'{disc.file_name}.cu2'))
+
+
+def _cu2_present(game_list):
+    return {game.cue_sheet.game_name: game.cu2_present for game in game_list}
+
+
+# The second scan takes every game from the scan cache, the CU2 flags have to be checked again on the card
+def test_parse_game_list_finds_the_cu2_sheets(library):
+    library_path, discs = library
+    expected = {disc.file_name: _has_cu2(library_path, disc) for disc in discs}
+    assert any(expected.values()) and not all(expected.values())
+
+    game_handler = GameHandler()
+    assert _cu2_present(game_handler.parse_game_list(library_path)) == expected
+    assert _cu2_present(game_handler.parse_game_list(library_path)) == expected
+
+
+# Games that already have a CU2 sheet are left alone, their cue sheets included (write_cu2 deletes the cue sheet)
+def test_generate_cu2_sheets_skips_existing_cu2_sheets(library):
+    library_path, discs = library
+    with_cu2 = {disc.file_name for disc in discs if _has_cu2(library_path, disc)}
+    assert with_cu2
+
+    game_handler = GameHandler()
+    results = game_handler.generate_cu2_sheets(game_handler.parse_game_list(library_path))
+
+    assert {result.game.cue_sheet.game_name for result in results} == {disc.file_name for disc in discs} - with_cu2
+    for disc in discs:
+        if disc.file_name in with_cu2:
+            assert exists(join(library_path, disc.directory, f'{disc.file_name}.cue'))
+
+
+# Two discs whose names are the same once cut down to MAX_GAME_NAME_LENGTH: only the first one is renamed, even when
+# both are renamed at the same time (the rename is slowed down so both workers reach it together)
+def test_renames_to_the_same_name_do_not_overwrite_each_other(application_directory, monkeypatch, caplog):
+    game_directory = application_directory / 'sdcard' / 'Long Game'
+    game_directory.mkdir(parents=True)
+    names = [f'{"A Game With A Very Long Name" * 2} (Disc {disc})' for disc in (1, 2)]
+    for disc, name in enumerate(names, start=1):
+        write_game(str(game_directory), name, IMAGE_SIZE, serial=f'SLUS_900.0{disc}')
+    write_database(str(application_directory / 'psio_assist.db'), [])
+
+    rename_game = GameHandler._rename_game
+
+    def slow_rename_game(*args, **kwargs):
+        time.sleep(0.2)
+        return rename_game(*args, **kwargs)
+
+    monkeypatch.setattr(GameHandler, '_rename_game', slow_rename_game)
+
+    game_handler = GameHandler()
+    game_list = game_handler.parse_game_list(str(application_directory / 'sdcard'))
+    game_handler.process_games(False, False, False, True, False, game_list)
+
+    # Whichever disc gets to the rename first takes the name, the other keeps its own
+    bin_files = {path.name for path in game_directory.glob('*.bin')}
+    assert len(bin_files) == 2
+    assert f'{names[0][:game_handler.MAX_GAME_NAME_LENGTH]}.bin' in bin_files
+    assert bin_files & {f'{name}.bin' for name in names}
+    errors = [record.getMessage() for record in caplog.records if record.levelno >= logging.ERROR]
+    assert len(errors) == 1 and errors[0].startswith('Not renaming ')
@@ -0,0 +1,55 @@
+"""
+Cold-start import checks, based on python -X importtime
+"""
+import os
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+import pytest
+
+PROJECT_ROOT = dirname(dirname(abspath(__file__)))
+
+# Cumulative import time budget for the headless entry point, in microseconds. Generous enough for a slow SD card
+# on a Raspberry Pi-class machine, it is there to catch a heavy dependency creeping back into the import graph.
+IMPORT_TIME_BUDGET_US = int(os.environ.get('PSIO_IMPORT_TIME_BUDGET_US', 500_000))
+
+# Modules that must only be loaded once the feature that needs them is used
+HEAVY_MODULES = ('PyQt6', 'pandas', 'requests', 'bs4', 'pathlib2', 'numpy')
+
+
+# Function that imports a module in a fresh interpreter and returns {module name: cumulative import time in us}
+def _import_times(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=PROJECT_ROOT,
+                            env={**os.environ, 'PYTHONPATH': PROJECT_ROOT, 'PYTHONDONTWRITEBYTECODE': '1'},
+                            capture_output=True, text=True, check=True)
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+@pytest.mark.parametrize('module', ['psio_sdcardmanager.__main__', 'psio_sdcardmanager.gamehandler',
+                                    'psio_sdcardmanager.psdatacenter'])
+def test_core_does_not_import_heavy_modules(module):
+    import_times = _import_times(module)
+    loaded = [name for name in import_times if name.split('.')[0] in HEAVY_MODULES]
+    assert not loaded, f'{module} imports {loaded}'
+
+
+def test_cli_does_not_load_the_core_until_a_command_runs():
+    assert 'psio_sdcardmanager.gamehandler' not in _import_times('psio_sdcardmanager.__main__')
+
+
+def test_cli_import_time_budget():
+    import_times = _import_times('psio_sdcardmanager.__main__')
+    assert import_times['psio_sdcardmanager.__main__'] < IMPORT_TIME_BUDGET_US
+
+
+def test_core_import_time_budget():
+    import_times = _import_times('psio_sdcardmanager.gamehandler')
+    assert import_times['psio_sdcardmanager.gamehandler'] < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,22 @@
+"""
+Headless CLI exit statuses, scripts (e.g. cron jobs) rely on them
+"""
+from psio_sdcardmanager import db
+from psio_sdcardmanager.__main__ import main
+
+
+def test_missing_database_fails(data_path, capsys):
+    assert main(['scan', str(data_path)]) == 1
+    output = capsys.readouterr()
+    assert output.out == ''
+    assert 'Database split-files not found' in output.err
+
+
+def test_failed_database_merge_fails(data_path, capsys):
+    (data_path / db.DATABASE_MANIFEST_FILE).write_text('filename,filesize,encoding,header\npsio_assist_1.db,100,,\n')
+    (data_path / 'psio_assist_1.db').write_bytes(b'\0' * 99)
+
+    assert main(['scan', str(data_path)]) == 1
+    output = capsys.readouterr()
+    assert output.out == ''
+    assert 'Unable to merge database file' in output.err
@@ -0,0 +1,42 @@
+"""
+Serial lookups on malformed images: they have to end in a serial or SerialNotFoundError, never in another exception
+"""
+import pytest
+
+from psio_sdcardmanager.serial_finder import get_serial, SerialNotFoundError, _find_directory_entry
+from tests.synthetic import (ISO_SECTOR_SIZE, RAW_SECTOR_SIZE, ROOT_DIRECTORY_SECTOR, SECTOR_SYNC, _directory_record,
+                             write_disc_image)
+
+
+@pytest.mark.parametrize('size', range(12, 17))
+def test_short_image_starting_with_the_sector_sync(tmp_path, size):
+    image_path = tmp_path / 'short.bin'
+    image_path.write_bytes((SECTOR_SYNC + b'\0\x02\0\x02')[:size])
+    with pytest.raises(SerialNotFoundError):
+        get_serial(str(image_path))
+
+
+# The SYSTEM.CNF lookup gives up on the corrupt root directory and the serial is found by scanning the image
+def test_corrupt_directory_record_falls_back_to_the_scan(tmp_path):
+    image_path = str(tmp_path / 'corrupt.bin')
+    write_disc_image(image_path, 64 * RAW_SECTOR_SIZE)
+
+    with open(image_path, 'r+b') as image_file:
+        # A record shorter than its own fields right after the root directory's ".", ".." and SYSTEM.CNF records
+        # (the user data of a MODE2/2352 sector starts 24 bytes in)
+        image_file.seek(ROOT_DIRECTORY_SECTOR * RAW_SECTOR_SIZE + 24)
+        records = image_file.read(ISO_SECTOR_SIZE)
+        image_file.seek(ROOT_DIRECTORY_SECTOR * RAW_SECTOR_SIZE + 24 + records.index(b'SYSTEM.CNF') - 33)
+        image_file.write(b'\x20')
+
+    assert get_serial(image_path) == 'SLUS_007.05'
+
+
+@pytest.mark.parametrize('directory', [
+    _directory_record(b'\0', 22, 2048, 2) + b'\x40',
+    _directory_record(b'\0', 22, 2048, 2) + b'\x30' + bytes(40),
+    b'\x21' + bytes(40),
+], ids=['truncated', 'past_the_end', 'too_short'])
+def test_corrupt_directory_record(directory):
+    with pytest.raises(ValueError):
+        _find_directory_entry(directory, b'SYSTEM.CNF')